@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+#   Copyright (c) MediaTek USA Inc., 2020-2024
+#
+#   This program is free software;  you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or (at
+#   your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY;  without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program;  if not, see
+#   <http://www.gnu.org/licenses/>.
+#
+#
+# Read, merge and write LCOV .info format tracefiles - so Python tools
+# (e.g., xml2lcov and py2lcov) can combine coverage data in-process rather
+# than calling 'lcov'.
+#
+# Only the coverage counts are kept:  data of all test names is summed
+# (as in the 'lcov --add-tracefile' result), and the LF/LH, BRF/BRH and
+# FNF/FNH summary records are recomputed when the data is written.
+# MC/DC data is not supported.
+#
+# Usage:
+#   tracefileutil.py -o merged.info a.info b.info.gz ...
+#
+# or, from Python:
+#   t = Tracefile()
+#   t.read('a.info')
+#   t.read('b.info')
+#   t.write('merged.info')
+
+import sys
+import argparse
+from xml2lcovutil import (FileCoverage, FunctionCoverage, LcovWriter,
+                          coverage_sum, decompress_errors, open_file)
+
+# records which are valid only between SF and end_of_record
+_recordData = ('DA', 'BRDA', 'FNL', 'FNA', 'FN', 'FNDA', 'VER')
+
+
+class TracefileReader:
+    """Stream the records of an LCOV .info file:  iterate to get
+    (testName, sourceFile, version, FileCoverage) of each record.
+
+    As in lcov, the branch index of each BRDA entry is its position in the
+    block - the index in the file is ignored - and a branch expression
+    (e.g., Verilog) is kept only if it is not the index.  Functions are
+    identified by location:  the FNA aliases of an FNL entry share its
+    first and last line.
+    """
+
+    def __init__(self, filename, keepGoing=False):
+        self._filename = filename
+        self._keepGoing = keepGoing
+
+    def _error(self, lineNo, message):
+        if lineNo is None:
+            print('"%s": Error: %s' % (self._filename, message))
+        else:
+            print('"%s":%d: Error: %s' % (self._filename, lineNo, message))
+        if not self._keepGoing:
+            sys.exit(1)
+
+    @staticmethod
+    def _count(value):
+        # hit counts may be written as floats - e.g., by Perl
+        try:
+            return int(value)
+        except ValueError:
+            return int(float(value))
+
+    @staticmethod
+    def _new_record():
+        # (version, lines, branches, functions, locations, fnByName,
+        #  nextBranch, exprs, notEvaluated) of a record
+        return None, [], [], [], {}, {}, {}, {}, set()
+
+    def __iter__(self):
+        try:
+            yield from self._read()
+        except (OSError, EOFError) + decompress_errors() as err:
+            self._error(None, "unable to read file: %s" % str(err))
+
+    def _read(self):
+        testName = ''
+        sourceFile = None
+        lineNo = 0
+        (version, lines, branches, functions, locations, fnByName,
+         nextBranch, exprs, notEvaluated) = self._new_record()
+        with open_file(self._filename, 'r') as f:
+            for lineNo, line in enumerate(f, 1):
+                tag, _, value = line.rstrip('\r\n').partition(':')
+                if sourceFile is None and tag in _recordData:
+                    self._error(lineNo, "'%s' record outside of SF" % tag)
+                    continue
+                try:
+                    if tag == 'DA':
+                        fields = value.split(',')
+                        n = self._count(fields[1])
+                        if n < 0:
+                            self._error(lineNo, "negative hit count '%s'" % line.rstrip())
+                            n = 0
+                        lines.append((int(fields[0]), n,
+                                      fields[2] if len(fields) > 2 else None))
+                    elif tag == 'BRDA':
+                        brLine, block, value = value.split(',', 2)
+                        expr, _, taken = value.rpartition(',')
+                        brLine = int(brLine)
+                        if brLine <= 0:
+                            self._error(lineNo, "unexpected line number in '%s'" % line.rstrip())
+                            continue
+                        isException = block.startswith('e')
+                        if isException:
+                            block = block[1:]
+                        key = (brLine, int(block))
+                        index = nextBranch.get(key, 0)
+                        nextBranch[key] = index + 1
+                        branchId = FileCoverage.branch_id(key[1], index,
+                                                          isException)
+                        if taken == '-':
+                            notEvaluated.add((brLine, branchId))
+                            taken = 0
+                        else:
+                            taken = self._count(taken)
+                        if expr != str(index):
+                            exprs[(brLine, branchId)] = expr
+                        branches.append((brLine, branchId, taken))
+                    elif tag == 'FNL':
+                        fields = value.split(',')
+                        locations[fields[0]] = (
+                            int(fields[1]),
+                            int(fields[2]) if len(fields) > 2 else None)
+                    elif tag == 'FNA':
+                        index, hit, name = value.split(',', 2)
+                        start, end = locations[index]
+                        functions.append(FunctionCoverage(
+                            name, start, end, self._count(hit)))
+                    elif tag == 'FN':
+                        # old format:  FN:start[,end],name and FNDA:hit,name
+                        start, name = value.split(',', 1)
+                        start, end = int(start), None
+                        fields = name.split(',', 1)
+                        if len(fields) == 2 and fields[0].isdigit():
+                            end, name = int(fields[0]), fields[1]
+                        if name not in fnByName:
+                            fnByName[name] = FunctionCoverage(name, start, end, 0)
+                            functions.append(fnByName[name])
+                    elif tag == 'FNDA':
+                        hit, name = value.split(',', 1)
+                        if name in fnByName:
+                            fnByName[name].hit += self._count(hit)
+                        else:
+                            self._error(lineNo, "unknown function '%s'" % name)
+                    elif tag == 'SF':
+                        if sourceFile is not None:
+                            self._error(lineNo, "missing end_of_record for '%s'" % sourceFile)
+                        sourceFile = value
+                        (version, lines, branches, functions, locations,
+                         fnByName, nextBranch, exprs,
+                         notEvaluated) = self._new_record()
+                    elif tag == 'VER':
+                        version = value
+                    elif line.startswith('end_of_record'):
+                        if sourceFile is None:
+                            self._error(lineNo, "end_of_record without SF")
+                            continue
+                        yield (testName, sourceFile, version,
+                               self._build(lines, branches, functions,
+                                           exprs, notEvaluated))
+                        sourceFile = None
+                    elif tag == 'TN':
+                        testName = value
+                    elif tag in ('LF', 'LH', 'BRF', 'BRH', 'FNF', 'FNH'):
+                        # summary data - recomputed when written
+                        pass
+                    elif line.strip() and not line.startswith('#'):
+                        self._error(lineNo, "unsupported .info file record '%s'" % line.rstrip())
+                except (ValueError, IndexError, KeyError):
+                    self._error(lineNo, "malformed .info file record '%s'" % line.rstrip())
+        if sourceFile is not None:
+            self._error(lineNo, "missing end_of_record for '%s'" % sourceFile)
+
+    @staticmethod
+    def _build(lines, branches, functions, exprs, notEvaluated):
+        if any(lines[i][0] >= lines[i + 1][0] for i in range(len(lines) - 1)):
+            # duplicate or out-of-order lines:  sum the counts
+            summed = {}
+            for lineNo, hit, checksum in lines:
+                if lineNo in summed:
+                    hit += summed[lineNo][1]
+                    checksum = summed[lineNo][2] or checksum
+                summed[lineNo] = (lineNo, hit, checksum)
+            lines = sorted(summed.values())
+        branches.sort()
+        checksums = None
+        if any(l[2] is not None for l in lines):
+            checksums = [l[2] for l in lines]
+        return FileCoverage([l[0] for l in lines], [l[1] for l in lines],
+                            [b[0] for b in branches], [b[1] for b in branches],
+                            [b[2] for b in branches], functions, checksums,
+                            exprs or None, notEvaluated or None)
+
+
+class Tracefile:
+    """Coverage data of one or more LCOV tracefiles:  the data of each
+    source file is summed - see 'coverage_sum'."""
+
+    def __init__(self, keepGoing=False):
+        self._keepGoing = keepGoing
+        self._files = {}    # source file -> [version, coverage accumulator]
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, sourceFile):
+        return sourceFile in self._files
+
+    def __getitem__(self, sourceFile):
+        return self._files[sourceFile][1].result()
+
+    def items(self):
+        """Return iterable of (sourceFile, version, FileCoverage)."""
+        return ((name, v[0], v[1].result()) for name, v in self._files.items())
+
+    def add(self, sourceFile, data, version=None):
+        """Add FileCoverage 'data' of 'sourceFile' - merge with existing
+        data of that file."""
+        entry = self._files.get(sourceFile)
+        if entry is None:
+            self._files[sourceFile] = [version, coverage_sum(data)]
+            return
+        if version != entry[0]:
+            if entry[0] is None:
+                entry[0] = version
+            elif version is not None:
+                print("Error: version mismatch for '%s': '%s' vs. '%s'" % (
+                    sourceFile, entry[0], version))
+                if not self._keepGoing:
+                    sys.exit(1)
+        entry[1].merge(data)
+
+    def read(self, filename):
+        """Read and merge all the records of LCOV .info file 'filename'."""
+        for testName, sourceFile, version, data in TracefileReader(
+                filename, self._keepGoing):
+            self.add(sourceFile, data, version)
+
+    def write(self, filename, testName=''):
+        """Write the data to LCOV .info file 'filename' - compressed if the
+        name has a compression suffix."""
+        out = LcovWriter(filename)
+        out.header(testName)
+        for name, version, data in self.items():
+            out.record(name, LcovWriter.format_data(data), version)
+        out.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge LCOV .info format tracefiles.")
+    parser.add_argument('-o', '--output', dest='output', required=True,
+                        help="merged LCOV .info file - compressed if name ends in .gz, .bz2, .xz or .zst")
+    parser.add_argument('-t', '--test-name', '--testname', dest='testName', default='',
+                        help="specify the test name for the TN: entry in LCOV .info file")
+    parser.add_argument('-k', "--keep-going", dest='keepGoing', default=False, action='store_true',
+                        help="ignore errors")
+    parser.add_argument('inputs', nargs='+',
+                        help="LCOV .info files - may be compressed")
+    args = parser.parse_args()
+
+    t = Tracefile(args.keepGoing)
+    for f in args.inputs:
+        t.read(f)
+    t.write(args.output, args.testName)
+
+
+if __name__ == '__main__':
+    main()
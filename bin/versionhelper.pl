@@ -0,0 +1,61 @@
+#!/usr/bin/env perl
+
+#   Copyright (c) MediaTek USA Inc., 2024
+#
+#   This program is free software;  you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or (at
+#   your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY;  without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program;  if not, see
+#   <http://www.gnu.org/licenses/>.
+#
+#
+# versionhelper.pl module.pm [module_args]
+#
+#   Helper for py2lcov/xml2lcov:  load a '--version-script' Perl module once,
+#   then answer version requests using the batch protocol - read one pathname
+#   per line from stdin, and write one line per pathname to stdout:
+#   '0 version' on success or '1 message' on failure.
+#   This lets the Python tools write version data as the .info file is
+#   generated - rather than re-reading and re-writing the file via 'lcov -a'.
+
+use strict;
+use warnings;
+use FindBin;
+
+use lib "$FindBin::RealBin/../lib";
+use lcovutil;
+
+die("usage: $0 module.pm [module_args]\n")
+    unless (@ARGV && $ARGV[0] =~ /\.pm$/);
+
+eval { lcovutil::configure_callback(\$lcovutil::versionCallback, @ARGV); };
+if ($@ ||
+    !defined($lcovutil::versionCallback)) {
+    print(STDERR "unable to create version callback from '" .
+          join(' ', @ARGV) . "'" . ($@ ? ": $@" : "\n"));
+    exit(1);
+}
+
+$| = 1;
+while (my $filename = <STDIN>) {
+    chomp($filename);
+    my $version =
+        eval { $lcovutil::versionCallback->extract_version($filename) };
+    if ($@) {
+        my $msg = $@;
+        $msg =~ s/\s+$//;
+        $msg =~ s/\s+/ /g;
+        print("1 $msg\n");
+    } else {
+        print('0 ' . (defined($version) ? $version : '') . "\n");
+    }
+}
+exit(0);
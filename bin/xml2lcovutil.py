@@ -28,42 +28,1346 @@
 #
 # @todo figure out how to characterize branch expressions in XML data
 
+# Only the modules needed by every conversion are imported here:  the others
+#   are imported by the functions which use them - so that a small job does
+#   not pay for features it does not use (see tests/bin/startupbench).
 import os
 import os.path
 import sys
 import re
-import xml.etree.ElementTree as ET
-import fnmatch
-import subprocess
-import copy
-import base64
-import hashlib
-import pdb
+import array
+import bisect
+import time
+import collections
+import functools
+import itertools
+import operator
+
+# compression schemes supported for input and output files - chosen by
+#   file name suffix
+_compressedSuffixes = ('.gz', '.bz2', '.xz', '.zst')
+
+
+def strip_compressed_suffix(filename):
+    """Return 'filename' without its compression suffix - if any."""
+    base, ext = os.path.splitext(filename)
+    return base if ext in _compressedSuffixes else filename
+
+
+def open_file(filename, mode):
+    """Open 'filename' - transparently compressing or decompressing if its
+    name ends in one of '_compressedSuffixes'.
+    'mode' is as for the builtin 'open'."""
+    ext = os.path.splitext(filename)[1]
+    if ext in _compressedSuffixes and 't' not in mode and 'b' not in mode:
+        # compression modules default to binary
+        mode += 't'
+    if ext == '.gz':
+        import gzip
+        return gzip.open(filename, mode)
+    if ext == '.bz2':
+        import bz2
+        return bz2.open(filename, mode)
+    if ext == '.xz':
+        import lzma
+        return lzma.open(filename, mode)
+    if ext == '.zst':
+        try:
+            # standard library from Python 3.14
+            from compression import zstd
+        except ImportError:
+            try:
+                import zstandard as zstd
+            except ImportError:
+                print("Error: cannot open %s: no 'zstandard' module - see 'pip install zstandard'" % (filename))
+                sys.exit(1)
+        return zstd.open(filename, mode)
+    return open(filename, mode)
+
+
+def decompress_errors():
+    """Return tuple of the exceptions - other than OSError and EOFError -
+    which the decompression modules used by 'open_file' raise for corrupt
+    data.  Only modules which are already loaded are checked:  the tuple is
+    meant to be computed when handling an error."""
+    errors = []
+    for name, error in (('zlib', 'error'),
+                        ('lzma', 'LZMAError'),
+                        ('compression.zstd', 'ZstdError'),
+                        ('zstandard', 'ZstdError')):
+        module = sys.modules.get(name)
+        if module is not None and hasattr(module, error):
+            errors.append(getattr(module, error))
+    return tuple(errors)
+
 
 def line_hash(line: str) -> str:
     """Produce a hash of a source line for use in the LCOV file."""
+    import base64
+    import hashlib
     hashed = hashlib.md5(line.encode("utf-8")).digest()
     return base64.b64encode(hashed).decode("ascii").rstrip("=")
 
 
+def file_stamp(filename):
+    """Return [size, modification time] of 'filename' - or None if it does
+    not exist.  Cache entries derived from the file are valid as long as
+    its stamp is unchanged."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _write_cache_file(cacheFile, content):
+    # write to temp file, then rename - so concurrent runs never see a
+    #   partial entry
+    import json
+    tmp = "%s.%d" % (cacheFile, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmp, cacheFile)
+    except OSError as err:
+        print("Warning: unable to write cache file %s: %s" % (
+            cacheFile, str(err)))
+
+
+def _touch(cacheFile):
+    # mark cache file as used - see '_prune_cache_dir'
+    try:
+        os.utime(cacheFile)
+    except OSError:
+        pass
+
+
+def _prune_cache_dir(cacheDir, maxBytes):
+    # if the files in 'cacheDir' take more than 'maxBytes', remove the least
+    #   recently used (i.e., written or touched) until they take 3/4 of that
+    #   - so the directory is not scanned again by every run
+    entries = []
+    total = 0
+    try:
+        with os.scandir(cacheDir) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total += st.st_size
+    except OSError:
+        return
+    if total <= maxBytes:
+        return
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= maxBytes * 3 // 4:
+            break
+        try:
+            os.unlink(path)
+            total -= size
+        except OSError:
+            pass
+
+
+class SourceText:
+    """Content of one source file:  'text', and the list of its 'lines' -
+    split only when first used."""
+    __slots__ = ('text', '_lines')
+
+    def __init__(self, text):
+        self.text = text
+        self._lines = None
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = self.text.split('\n')
+        return self._lines
+
+
+class SourceCache:
+    """Recently used source files - shared by all consumers (line checksums,
+    Python function derivation) in one run, so that a file which appears
+    in several records or inputs is read just once.
+
+    At most 'maxEntries' files, and about 'maxBytes' of text, are kept:
+    least recently used entries are dropped first.
+    """
+
+    def __init__(self, maxEntries=256, maxBytes=64 << 20):
+        self._recent = collections.OrderedDict()
+        self._maxEntries = maxEntries
+        self._maxBytes = maxBytes
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename):
+        """Return SourceText of 'filename' - or None if the file cannot be
+        read."""
+        pathname = os.path.abspath(filename)
+        source = self._recent.get(pathname)
+        if source is not None:
+            self._recent.move_to_end(pathname)
+            self.hits += 1
+            return source
+        self.misses += 1
+        try:
+            with open(filename, 'r') as f:
+                source = SourceText(f.read())
+        except (OSError, UnicodeDecodeError):
+            return None
+        self._recent[pathname] = source
+        self._size += len(source.text)
+        while self._recent and (len(self._recent) > self._maxEntries or
+                                self._size > self._maxBytes):
+            name, old = self._recent.popitem(last=False)
+            self._size -= len(old.text)
+        return source
+
+    def clear(self):
+        self._recent.clear()
+        self._size = 0
+
+    def report(self):
+        print("source cache: %d hits, %d misses" % (self.hits, self.misses))
+
+
+class ChecksumCache:
+    """Per-line checksums of source files - see 'line_hash'.
+
+    Checksums of recently used files are kept in memory.  If 'cacheDir' is
+    set, they are also stored on disk so that later runs need not re-read
+    or re-hash unchanged files.  Entries are keyed by pathname, and are
+    valid only as long as the file size and modification time match.
+    The directory is pruned to 'maxBytes' - see 'prune'.
+    """
+    maxBytes = 256 << 20
+
+    def __init__(self, cacheDir=None, maxEntries=256, sources=None):
+        # absolute:  the cache may be shared by jobs run from different
+        #   directories - see 'ConverterCaches'
+        self._dir = os.path.join(os.path.abspath(cacheDir), 'checksum') if cacheDir else None
+        self._sources = sources if sources is not None else SourceCache()
+        if self._dir:
+            os.makedirs(self._dir, exist_ok=True)
+        self._recent = collections.OrderedDict()
+        self._maxEntries = maxEntries
+        self._written = False
+        self.hits = 0
+        self.misses = 0
+
+    def _cacheFile(self, pathname):
+        import hashlib
+        digest = hashlib.sha1(pathname.encode('utf-8', 'surrogateescape'))
+        return os.path.join(self._dir, digest.hexdigest() + '.json')
+
+    def get(self, filename):
+        """Return list of checksums of the lines in 'filename' - or None if
+        the file cannot be read."""
+        stamp = file_stamp(filename)
+        if stamp is None:
+            return None
+        pathname = os.path.abspath(filename)
+
+        entry = self._recent.get(pathname)
+        if entry and entry[0] == stamp:
+            self._recent.move_to_end(pathname)
+            self.hits += 1
+            return entry[1]
+
+        checksums = None
+        if self._dir:
+            import json
+            cacheFile = self._cacheFile(pathname)
+            try:
+                with open(cacheFile, 'r') as f:
+                    cached = json.load(f)
+                if cached['path'] == pathname and cached['stamp'] == stamp:
+                    checksums = cached['checksums']
+                    _touch(cacheFile)
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        if checksums is None:
+            self.misses += 1
+            source = self._sources.get(filename)
+            if source is None:
+                return None
+            checksums = [line_hash(line) for line in source.lines]
+            if self._dir:
+                _write_cache_file(self._cacheFile(pathname),
+                                  {'path' : pathname,
+                                   'stamp' : stamp,
+                                   'checksums' : checksums})
+                self._written = True
+        else:
+            self.hits += 1
+
+        self._recent[pathname] = (stamp, checksums)
+        if len(self._recent) > self._maxEntries:
+            self._recent.popitem(last=False)
+        return checksums
+
+    def prune(self):
+        """Remove the least recently used entries if the cache directory has
+        grown beyond 'maxBytes'.  Called when a run wrote new entries."""
+        if self._written:
+            _prune_cache_dir(self._dir, self.maxBytes)
+            self._written = False
+
+    def report(self):
+        print("checksum cache: %d hits, %d misses" % (self.hits, self.misses))
+
+
+class Profile:
+    """Timing data - saved in the same JSON format as the '--profile' data
+    of the Perl tools (see lcovutil::save_profile) so the same utilities -
+    e.g., scripts/spreadsheet.py - can be used to analyze it.
+    """
+
+    def __init__(self, argv=None):
+        # 'argv':  command line arguments to record - default: ours
+        self._start = time.perf_counter()
+        self._argv = sys.argv[1:] if argv is None else argv
+        self.data = {}
+
+    def add(self, key, name, elapsed):
+        """Add 'elapsed' seconds to the time of 'name' in category 'key'."""
+        times = self.data.setdefault(key, {})
+        times[name] = times.get(name, 0) + elapsed
+
+    def merge(self, data):
+        for key, times in data.items():
+            for name, elapsed in times.items():
+                self.add(key, name, elapsed)
+
+    def save(self, filename, maxParallel):
+        import json
+        uname = os.uname()
+        cmdLine = ' '.join(["'%s'" % a if re.search(r'\s', a) else a
+                            for a in [os.path.basename(sys.argv[0])] + self._argv])
+        self.data['config'] = {
+            'tool'        : os.path.basename(sys.argv[0]),
+            'bin'         : os.path.dirname(os.path.realpath(sys.argv[0])),
+            'cmdLine'     : cmdLine,
+            'buildDir'    : os.getcwd(),
+            'date'        : time.strftime('%a %b %d %H:%M:%S %Z %Y'),
+            'uname'       : ' '.join(uname),
+            'hostname'    : uname.nodename,
+            'cores'       : os.cpu_count() or 1,
+            'maxParallel' : maxParallel,
+        }
+        self.data['total'] = time.perf_counter() - self._start
+        try:
+            with open(filename, 'w') as f:
+                json.dump(self.data, f)
+        except OSError as err:
+            print("Warning: unable to open profile output %s: '%s'" % (
+                filename, str(err)))
+
+
+class FragmentCache:
+    """Translated LCOV data of each input file - so unchanged inputs need
+    not be parsed again by later runs.
+
+    Entries are keyed by a digest of the input file content and of the
+    options which affect the translation.  Each entry also records the
+    stamp (see 'file_stamp') of each source file named in the data:  line
+    checksums, derived function data, and source path resolution all
+    depend on the source files - so the entry is stale if any of them has
+    changed.  Similarly, it records the stamp of each directory searched
+    for a source file (see 'notes') - so a source file which is created
+    or removed is seen - and the warnings to repeat when it is used.
+    The LCOV text is kept in a separate '<key>.info' file:  it is written
+    while the input is translated (see 'LcovWriter.capture'), and copied
+    to the output when used - so it is never held in memory.
+    Stale entries are removed when found, and the directory is pruned to
+    'maxBytes' - see 'prune'.
+    """
+    # bump if the translation result changes for the same input and options
+    _format = 4
+    maxBytes = 1 << 30
+
+    def __init__(self, cacheDir, options):
+        self._dir = os.path.join(cacheDir, 'fragment')
+        os.makedirs(self._dir, exist_ok=True)
+        # source file names are relative to the current directory
+        self._options = repr((self._format, os.getcwd(), options)).encode('utf-8')
+        self._written = False
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, filename, configFiles=()):
+        """Return the cache key of input 'filename' - or None if the file
+        cannot be read.  The content of 'configFiles' (e.g., the Coverage.py
+        configuration) is part of the key too."""
+        import hashlib
+        h = hashlib.sha256(self._options)
+        for name in configFiles:
+            h.update(name.encode('utf-8', 'surrogateescape') + b'\0')
+            try:
+                with open(name, 'rb') as f:
+                    h.update(f.read())
+            except OSError:
+                h.update(b'\0')
+        try:
+            with open(filename, 'rb') as f:
+                for chunk in iter(functools.partial(f.read, 1 << 20), b''):
+                    h.update(chunk)
+        except OSError:
+            return None
+        return h.hexdigest()
+
+    @staticmethod
+    def notes():
+        """Return a new record of what a translation depends on, other than
+        its input and source files:  the directories searched for source
+        files, the warnings printed, and whether an error was ignored (see
+        '--keep-going') - in which case the result is not cached."""
+        return {'dirs' : set(), 'warnings' : [], 'failed' : False}
+
+    @staticmethod
+    def merge_notes(notes, other):
+        notes['dirs'].update(other['dirs'])
+        notes['warnings'].extend(other['warnings'])
+        notes['failed'] = notes['failed'] or other['failed']
+
+    def _entry(self, key):
+        return os.path.join(self._dir, key + '.json')
+
+    def _fragment(self, key):
+        return os.path.join(self._dir, key + '.info')
+
+    def get(self, key, count=True):
+        """Return (name of file containing the cached LCOV text, warnings)
+        for 'key' - or None.
+        'count' is false when just checking whether the entry is there."""
+        import json
+        entryFile = self._entry(key)
+        fragment = self._fragment(key)
+        try:
+            with open(entryFile, 'r') as f:
+                entry = json.load(f)
+            for name, stamp in itertools.chain(entry['sources'].items(),
+                                               entry['dirs'].items()):
+                if file_stamp(name) != stamp:
+                    # stale:  some source file or directory changed
+                    for stale in (entryFile, fragment):
+                        try:
+                            os.unlink(stale)
+                        except OSError:
+                            pass
+                    break
+            else:
+                if os.path.exists(fragment):
+                    if count:
+                        self.hits += 1
+                        _touch(entryFile)
+                        _touch(fragment)
+                    return fragment, entry['warnings']
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+        if count:
+            self.misses += 1
+        return None
+
+    def fragment_file(self, key):
+        """Return name of the temporary file to write the LCOV text of 'key'
+        to - see 'put'."""
+        return "%s.%d" % (self._fragment(key), os.getpid())
+
+    def put(self, key, notes):
+        """Save the LCOV text written to 'fragment_file(key)' as the entry of
+        'key' - unless 'notes' say that the translation failed."""
+        tmp = self.fragment_file(key)
+        if notes['failed']:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        sources = {}
+        try:
+            with open(tmp, 'r') as f:
+                for line in f:
+                    if line.startswith('SF:'):
+                        name = line[3:].rstrip('\n')
+                        sources[name] = file_stamp(name)
+            os.replace(tmp, self._fragment(key))
+        except OSError as err:
+            print("Warning: unable to write cache file %s: %s" % (
+                self._fragment(key), str(err)))
+            return
+        dirs = {name : file_stamp(name)
+                for name in (d if d else '.' for d in notes['dirs'])}
+        _write_cache_file(self._entry(key),
+                          {'sources' : sources,
+                           'dirs' : dirs,
+                           'warnings' : notes['warnings']})
+        self._written = True
+
+    def prune(self):
+        """Remove the least recently used entries if the cache directory has
+        grown beyond 'maxBytes'.  Called when a run wrote new entries."""
+        if self._written:
+            _prune_cache_dir(self._dir, self.maxBytes)
+            self._written = False
+
+    def report(self):
+        print("translation cache: %d hits, %d misses" % (self.hits, self.misses))
+
+
+class PathFilter:
+    """Select file names by lists of shell-style include and exclude glob
+    patterns - as for 'fnmatch.fnmatchcase'.
+
+    Each list is compiled just once, into a single regular expression with
+    one named group per pattern - so the cost of filtering a name does not
+    grow with the number of patterns, and we can still count the number of
+    names which were selected by each pattern.
+    A name is kept if it matches some include pattern (or there are no
+    include patterns) and it does not match any exclude pattern.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self._include = self._compile(include)
+        self._exclude = self._compile(exclude)
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        import fnmatch
+        regexp = re.compile('|'.join(
+            '(?P<p%d>%s)' % (idx, fnmatch.translate(p))
+            for idx, p in enumerate(patterns)))
+        # [regexp, patterns, match count of each pattern]
+        return (regexp, patterns, [0] * len(patterns))
+
+    @staticmethod
+    def _match(matcher, name):
+        m = matcher[0].match(name)
+        if m is None:
+            return False
+        # count the first pattern which matched
+        matcher[2][int(m.lastgroup[1:])] += 1
+        return True
+
+    def is_excluded(self, name):
+        if self._include and not self._match(self._include, name):
+            return True
+        return self._exclude is not None and self._match(self._exclude, name)
+
+    def report(self):
+        for matcher, kind in ((self._include, 'include'),
+                              (self._exclude, 'exclude')):
+            if matcher:
+                for pattern, count in zip(matcher[1], matcher[2]):
+                    print("%s pattern '%s': %d matches" % (kind, pattern, count))
+
+
+class SourceResolver:
+    """Find source files in a list of search paths.
+
+    Each directory is listed at most once - rather than calling stat() for
+    every candidate pathname - and lookup results (hits and misses) are
+    memoized by search path list and relative name.  A single instance is
+    shared by all the XML files processed in one run.
+    Directory names are usually relative:  all the data is valid only in
+    the working directory 'refresh' last saw.
+    """
+
+    def __init__(self):
+        self._cwd = os.getcwd()
+        self._dirs = {}       # directory -> frozenset of entries, or None
+        self._stamps = {}     # directory -> modification time when listed
+        self._found = {}      # (roots, name) -> index of root, or None
+        self.hits = 0
+        self.misses = 0
+
+    def _entries(self, dirname):
+        try:
+            return self._dirs[dirname]
+        except KeyError:
+            path = dirname if dirname else '.'
+            try:
+                self._stamps[dirname] = os.stat(path).st_mtime_ns
+                entries = frozenset(os.listdir(path))
+            except OSError:
+                self._stamps[dirname] = None
+                entries = None
+            self._dirs[dirname] = entries
+            return entries
+
+    def refresh(self):
+        """Forget the directories which changed since they were listed -
+        e.g., between the jobs of a long-running server.  Forget all of them
+        if the working directory changed."""
+        cwd = os.getcwd()
+        if cwd != self._cwd:
+            self._cwd = cwd
+            self._dirs = {}
+            self._stamps = {}
+            self._found = {}
+            return
+        changed = []
+        for dirname, stamp in self._stamps.items():
+            try:
+                current = os.stat(dirname if dirname else '.').st_mtime_ns
+            except OSError:
+                current = None
+            if current != stamp:
+                changed.append(dirname)
+        if changed:
+            for dirname in changed:
+                del self._dirs[dirname]
+                del self._stamps[dirname]
+            self._found = {}
+
+    def exists(self, path):
+        dirname, basename = os.path.split(path)
+        entries = self._entries(dirname)
+        return entries is not None and basename in entries
+
+    def resolve(self, roots, name):
+        """Return index of first entry in 'roots' which contains 'name' -
+        or None if not found."""
+        key = (roots, name)
+        try:
+            idx = self._found[key]
+            self.hits += 1
+            return idx
+        except KeyError:
+            self.misses += 1
+        idx = None
+        for i, root in enumerate(roots):
+            if self.exists(os.path.join(root, name)):
+                idx = i
+                break
+        self._found[key] = idx
+        return idx
+
+    def report(self):
+        print("source resolution cache: %d hits, %d misses, %d directories listed" % (
+            self.hits, self.misses, len(self._dirs)))
+
+
+class VersionScript:
+    """Call the '--version-script' callback for each source file.
+
+    In batch mode, 'cmd' is started just once.  It reads one pathname per
+    line from stdin, and answers each with one line on stdout:
+    '0 <version>' on success, or '<status> <message>' (non-zero status) on
+    failure.  Executable scripts which support the protocol are called with
+    the additional argument '--batch';  Perl modules are loaded by
+    'versionhelper.pl'.
+    Other scripts are called once per file - using a pool of 'jobs' threads,
+    so that several calls are in flight at once.
+
+    'submit(filename)' returns a callable which returns the version string
+    (or raises an exception).  Results must be collected in the order in
+    which they were submitted.
+    The script runs in directory 'cwd' (default:  the current directory) -
+    relative script and source file names are relative to it.
+    """
+
+    def __init__(self, cmd, batch=False, jobs=1, cwd=None):
+        self._cmd = cmd
+        self._cwd = cwd
+        self._proc = None
+        self._pool = None
+        if batch:
+            import subprocess
+            self._proc = subprocess.Popen(cmd,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          cwd=cwd,
+                                          universal_newlines=True)
+        elif jobs > 1:
+            import concurrent.futures
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        # number of lookups we let run ahead before waiting for the oldest.
+        #  Bounded so that the batch process never blocks on a full pipe.
+        self.window = 256 if batch else max(1, jobs) * 4
+
+    def _call(self, filename):
+        import subprocess
+        version = subprocess.check_output(self._cmd + [filename],
+                                          cwd=self._cwd)
+        return version.strip().decode('UTF-8')
+
+    def _read(self):
+        line = self._proc.stdout.readline()
+        if not line:
+            raise RuntimeError("version script '%s' exited unexpectedly" % (
+                ' '.join(self._cmd)))
+        status, _, text = line.rstrip('\n').partition(' ')
+        if status != '0':
+            raise RuntimeError(text)
+        return text.strip()
+
+    def submit(self, filename):
+        if self._proc:
+            try:
+                self._proc.stdin.write(filename + '\n')
+                self._proc.stdin.flush()
+            except OSError as err:
+                def failed(err=err):
+                    raise err
+                return failed
+            return self._read
+        if self._pool:
+            return self._pool.submit(self._call, filename).result
+        return functools.partial(self._call, filename)
+
+    def close(self):
+        if self._proc:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            self._proc.wait()
+            self._proc = None
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+
+
+class ConverterCaches:
+    """Caches and helper processes used by ProcessFile.  By default, each
+    ProcessFile has its own.  A long-running server (see 'serve') keeps
+    one instance and shares it with all its jobs - so later jobs find the
+    caches warm, and the version script already running.
+    Versions themselves are not cached:  they may depend on more than the
+    file (e.g., the state of a git repository).
+    """
+
+    def __init__(self):
+        self.resolver = SourceResolver()
+        self.scopes = PythonScopes()
+        self.sources = SourceCache()
+        self._checksums = {}  # cache directory -> ChecksumCache
+        # (cmd, batch, jobs, directory) -> VersionScript - most recently
+        #   used last
+        self._versions = collections.OrderedDict()
+
+    def checksums(self, cacheDir):
+        if cacheDir:
+            # relative to the directory of the current job
+            cacheDir = os.path.abspath(cacheDir)
+        checksums = self._checksums.get(cacheDir)
+        if checksums is None:
+            checksums = ChecksumCache(cacheDir, sources=self.sources)
+            self._checksums[cacheDir] = checksums
+        return checksums
+
+    # number of version scripts kept running - e.g., for jobs from
+    #   different directories
+    _maxVersionScripts = 8
+
+    def versions(self, cmd, batch=False, jobs=1):
+        # the script (and the file names sent to it) may be relative to the
+        #   job's directory:  each directory has its own instance
+        cwd = os.getcwd()
+        key = (tuple(cmd), batch, jobs, cwd)
+        versions = self._versions.get(key)
+        if versions is None:
+            versions = VersionScript(cmd, batch=batch, jobs=jobs, cwd=cwd)
+            self._versions[key] = versions
+            while len(self._versions) > self._maxVersionScripts:
+                self._versions.popitem(last=False)[1].close()
+        else:
+            self._versions.move_to_end(key)
+        return versions
+
+    def refresh(self):
+        """Forget data which may be stale:  called before each job of a
+        long-running server.  Checksums are validated by file stamp."""
+        self.resolver.refresh()
+        self.sources.clear()
+
+    def close(self):
+        """Stop the version scripts - e.g., after a failed job, as a batch
+        script may still have answers in flight."""
+        for versions in self._versions.values():
+            versions.close()
+        self._versions.clear()
+
+
+class PythonScopes:
+    """Find the function and class definitions in Python source code, using
+    the 'ast' module.
+
+    Results are cached by content digest, so each distinct source text is
+    parsed only once - no matter how many inputs refer to it.  At most
+    'maxEntries' results are kept:  least recently used are dropped first.
+    """
+
+    def __init__(self, maxEntries=1024):
+        self._cache = collections.OrderedDict()
+        self._maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, source):
+        """Return list of (isFunction, name, line, end, children) - in the
+        order that the scopes end (i.e., inner scopes first), or None if
+        'source' is not valid Python.
+        'name' is qualified by the enclosing scopes:  'outer.inner' for
+        functions, 'Class::method' for classes.
+        'children' is the list of (line, end) of directly nested scopes."""
+        import ast
+        import hashlib
+        key = hashlib.sha1(source.encode('utf-8', 'surrogateescape')).digest()
+        try:
+            scopes = self._cache[key]
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return scopes
+        except KeyError:
+            self.misses += 1
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            scopes = None
+        else:
+            scopes = []
+            self._visit(tree, '', scopes)
+        self._cache[key] = scopes
+        if len(self._cache) > self._maxEntries:
+            self._cache.popitem(last=False)
+        return scopes
+
+    def _visit(self, node, prefix, scopes):
+        # return (line, end) of scopes directly nested in 'node'
+        import ast
+        children = []
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                  ast.ClassDef)):
+                isFunction = not isinstance(child, ast.ClassDef)
+                name = prefix + child.name
+                sep = '.' if isFunction else '::'
+                nested = self._visit(child, name + sep, scopes)
+                scopes.append((isFunction, name, child.lineno,
+                               child.end_lineno, nested))
+                children.append((child.lineno, child.end_lineno))
+            else:
+                children.extend(self._visit(child, prefix, scopes))
+        return children
+
+    def report(self):
+        print("Python function derivation cache: %d hits, %d misses" % (
+            self.hits, self.misses))
+
+
+class FunctionCoverage:
+    """Function data:  name, first and last line, and hit count.  'end' is
+    None if the last line is not known."""
+    __slots__ = ('name', 'start', 'end', 'hit')
+
+    def __init__(self, name, start, end, hit):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.hit = hit
+
+    def __getstate__(self):
+        return (self.name, self.start, self.end, self.hit)
+
+    def __setstate__(self, state):
+        self.name, self.start, self.end, self.hit = state
+
+
+class FileCoverage:
+    """Coverage data of one source file - built by the readers, and written
+    by LcovWriter.
+      lines     : array of line numbers - in increasing order
+      hits      : array - hit count of each line in 'lines'
+      brLines   : array - line number of each branch
+      brIds     : array - packed block/branch ID (see 'branch_id') of each
+                  branch.  Branches are in increasing (line, ID) order
+      taken     : array - taken count of each branch
+      functions : list of FunctionCoverage.  Functions with the same first
+                  line are aliases (e.g., C++ template instances), written
+                  as one location - see 'LcovWriter.format_data'
+      checksums : list - checksum of each line in 'lines' (or None, if the
+                  checksum of that line is not known) - or None, if there
+                  are no checksums
+      brExprs   : dict (line, ID) -> branch expression - or None
+      notEvaluated : set of (line, ID) of branches whose expression was
+                  not evaluated ('-' taken count) - or None
+    Hit and taken counts are unsigned 64-bit:  sums of many large counts
+    may not fit in 32 bits.
+    """
+    __slots__ = ('lines', 'hits', 'brLines', 'brIds', 'taken', 'functions',
+                 'checksums', 'brExprs', 'notEvaluated')
+
+    def __init__(self, lines=(), hits=(), brLines=(), brIds=(), taken=(),
+                 functions=None, checksums=None, brExprs=None,
+                 notEvaluated=None):
+        self.lines = array.array('I', lines)
+        self.hits = array.array('Q', hits)
+        self.brLines = array.array('I', brLines)
+        self.brIds = array.array('Q', brIds)
+        self.taken = array.array('Q', taken)
+        self.functions = functions if functions is not None else []
+        self.checksums = checksums
+        self.brExprs = brExprs
+        self.notEvaluated = notEvaluated
+
+    def __getstate__(self):
+        return (self.lines, self.hits, self.brLines, self.brIds, self.taken,
+                self.functions, self.checksums, self.brExprs,
+                self.notEvaluated)
+
+    def __setstate__(self, state):
+        (self.lines, self.hits, self.brLines, self.brIds, self.taken,
+         self.functions, self.checksums, self.brExprs,
+         self.notEvaluated) = state
+
+    @staticmethod
+    def branch_id(block, branch, isException=False):
+        """Pack branch (block, branch, isException) into one (sortable)
+        integer.  Block IDs are 32-bit (e.g., gcc uses 4294967295)."""
+        return (block << 21) | (branch << 1) | (1 if isException else 0)
+
+    @staticmethod
+    def _sum(keys, counts, otherKeys, otherCounts):
+        # return (keys, counts):  the sum of the two sets of counts
+        if keys == otherKeys:
+            return keys, array.array('Q', map(operator.add, counts, otherCounts))
+        total = dict(zip(keys, counts))
+        for k, c in zip(otherKeys, otherCounts):
+            total[k] = total.get(k, 0) + c
+        keys = sorted(total)
+        return keys, array.array('Q', map(total.__getitem__, keys))
+
+    def merge(self, other):
+        """Add the coverage data in 'other' to this:  sum line, branch and
+        function hit counts."""
+        checksums = None
+        if self.checksums or other.checksums:
+            # keep the first checksum seen for each line
+            checksums = dict(zip(other.lines, other.checksums or ()))
+            checksums.update((l, c) for l, c in
+                             zip(self.lines, self.checksums or ()) if c is not None)
+        lines, self.hits = self._sum(self.lines, self.hits,
+                                     other.lines, other.hits)
+        self.lines = array.array('I', lines)
+        if checksums is not None:
+            self.checksums = [checksums.get(l) for l in self.lines]
+        self._merge_branch_notes(other)
+        self._merge_taken(other)
+        self._merge_functions(other)
+
+    def _merge_branch_notes(self, other):
+        # merge branch expressions and 'not evaluated' flags - before the
+        #  taken counts
+        if self.notEvaluated or other.notEvaluated:
+            # a branch is 'not evaluated' only if it was not evaluated in
+            #  every input which contains it
+            notEvaluated = ((self.notEvaluated or set()) |
+                            (other.notEvaluated or set()))
+            keys = set(zip(self.brLines, self.brIds))
+            otherKeys = set(zip(other.brLines, other.brIds))
+            notEvaluated -= keys - (self.notEvaluated or set())
+            notEvaluated -= otherKeys - (other.notEvaluated or set())
+            self.notEvaluated = notEvaluated or None
+        if other.brExprs:
+            exprs = dict(other.brExprs)
+            exprs.update(self.brExprs or ())
+            self.brExprs = exprs
+
+    def _merge_taken(self, other):
+        if (self.brLines == other.brLines and self.brIds == other.brIds):
+            self.taken = array.array('Q', map(operator.add, self.taken,
+                                              other.taken))
+        elif other.brLines:
+            keys, self.taken = self._sum(
+                list(zip(self.brLines, self.brIds)), self.taken,
+                list(zip(other.brLines, other.brIds)), other.taken)
+            self.brLines = array.array('I', map(operator.itemgetter(0), keys))
+            self.brIds = array.array('Q', map(operator.itemgetter(1), keys))
+
+    def _merge_functions(self, other):
+        # functions are identified by name and start line - e.g., Java
+        #  constructors all have the same name
+        functions = {(f.name, f.start) : f for f in self.functions}
+        for f in other.functions:
+            key = (f.name, f.start)
+            if key in functions:
+                functions[key].hit += f.hit
+            else:
+                f = FunctionCoverage(f.name, f.start, f.end, f.hit)
+                functions[key] = f
+                self.functions.append(f)
+
+
+_numpy = False    # NumPy module - None if not installed - see 'import_numpy'
+
+
+def import_numpy():
+    """Return the NumPy module, or None if it is not installed.  NumPy is
+    optional - and is imported only when first needed, as importing it
+    is slow."""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+
+class PythonCoverageSum:
+    """Sum of the coverage data of one source file:  'merge' FileCoverage
+    data into it, then get the 'result'.  See 'coverage_sum'."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def merge(self, other):
+        self._data.merge(other)
+
+    def result(self):
+        return self._data
+
+
+class NumpyCoverageSum:
+    """Sum of the coverage data of one source file - using NumPy.
+
+    Line hit counts are kept in a dense array indexed by line number, and
+    taken counts in an array aligned with the branch list - so each input
+    is added by a few vectorized operations rather than element by
+    element.  The result is the same as that of PythonCoverageSum.
+    """
+
+    def __init__(self, data):
+        np = import_numpy()
+        self._np = np
+        self._data = data    # functions, branch keys, ...
+        self._hits = np.zeros(0, dtype=np.uint64)
+        self._found = np.zeros(0, dtype=bool)
+        self._checksums = None
+        self._add_lines(data)
+        if data.checksums:
+            self._checksums = {l : c for l, c in zip(data.lines, data.checksums)
+                               if c is not None}
+        self._load_branches()
+
+    def _view(self, a):
+        # zero-copy NumPy view of array.array 'a'
+        return self._np.frombuffer(a, dtype='u%d' % a.itemsize)
+
+    def _load_branches(self):
+        self._brLines = self._view(self._data.brLines)
+        self._brIds = self._view(self._data.brIds)
+        self._taken = self._view(self._data.taken).copy()
+
+    def _add_lines(self, data):
+        np = self._np
+        lines = self._view(data.lines)
+        if not len(lines):
+            return
+        size = int(lines.max()) + 1
+        if size > len(self._hits):
+            size = max(size, 2 * len(self._hits))
+            hits = np.zeros(size, dtype=np.uint64)
+            hits[:len(self._hits)] = self._hits
+            found = np.zeros(size, dtype=bool)
+            found[:len(self._found)] = self._found
+            self._hits, self._found = hits, found
+        # line numbers are unique - so a fancy-indexed add is safe
+        self._hits[lines] += self._view(data.hits)
+        self._found[lines] = True
+
+    def merge(self, other):
+        np = self._np
+        self._add_lines(other)
+        if other.checksums:
+            # keep the first checksum seen for each line
+            if self._checksums is None:
+                self._checksums = {}
+            for l, c in zip(other.lines, other.checksums):
+                if c is not None:
+                    self._checksums.setdefault(l, c)
+
+        data = self._data
+        data._merge_branch_notes(other)
+        if (len(other.taken) == len(self._taken) and
+                np.array_equal(self._brLines, self._view(other.brLines)) and
+                np.array_equal(self._brIds, self._view(other.brIds))):
+            np.add(self._taken, self._view(other.taken), out=self._taken)
+        elif len(other.taken):
+            # different branches:  sum the counts of the union of the
+            #  (line, ID) keys - in sorted order
+            lines = np.concatenate((self._brLines, self._view(other.brLines)))
+            ids = np.concatenate((self._brIds, self._view(other.brIds)))
+            taken = np.concatenate((self._taken, self._view(other.taken)))
+            order = np.lexsort((ids, lines))
+            lines, ids, taken = lines[order], ids[order], taken[order]
+            first = np.ones(len(lines), dtype=bool)
+            first[1:] = (lines[1:] != lines[:-1]) | (ids[1:] != ids[:-1])
+            first = np.flatnonzero(first)
+            data.brLines = array.array('I', lines[first].tobytes())
+            data.brIds = array.array('Q', ids[first].tobytes())
+            self._load_branches()
+            self._taken = np.add.reduceat(taken, first)
+        data._merge_functions(other)
+
+    def result(self):
+        np = self._np
+        data = self._data
+        lines = np.flatnonzero(self._found)
+        data.lines = array.array('I', lines.astype('u%d' % data.lines.itemsize).tobytes())
+        data.hits = array.array('Q', self._hits[lines].tobytes())
+        data.taken = array.array('Q', self._taken.tobytes())
+        if self._checksums is not None:
+            data.checksums = [self._checksums.get(l) for l in data.lines]
+        return data
+
+
+def coverage_sum(data):
+    """Return an accumulator for the coverage data of one source file,
+    starting with FileCoverage 'data':  NumPy-based if NumPy is installed.
+    The accumulator takes ownership of 'data'."""
+    if import_numpy():
+        return NumpyCoverageSum(data)
+    return PythonCoverageSum(data)
+
+
+class LcovWriter:
+    """Buffered writer for LCOV tracefile data.
+
+    Each record is formatted in bulk - see 'format_data' - and the text is
+    collected in memory and written out in large blocks.
+    """
+
+    def __init__(self, filename, blockSize=1 << 20):
+        self._f = open_file(filename, 'w')
+        self._blockSize = blockSize
+        self._buffer = []
+        self._size = 0
+        self._tee = None      # see 'capture'
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self._blockSize:
+            self.flush()
+
+    def header(self, testName):
+        self.write("TN:%s\n" % testName)
+
+    def record(self, name, body, version=None):
+        """Write one record:  'body' as returned by format_data()."""
+        if version:
+            self.write("SF:%s\nVER:%s\n%send_of_record\n" % (name, version, body))
+        else:
+            self.write("SF:%s\n%send_of_record\n" % (name, body))
+
+    def capture(self, filename):
+        """Write all text from now on to (uncompressed) file 'filename' too -
+        until 'end_capture' is called.  E.g., to cache the translation of
+        one input."""
+        self.flush()
+        self._tee = open(filename, 'w')
+
+    def end_capture(self):
+        self.flush()
+        self._tee.close()
+        self._tee = None
+
+    def copy(self, fileobj):
+        """Append the content of 'fileobj' - e.g., a record fragment."""
+        self.flush()
+        if self._tee is None:
+            import shutil
+            shutil.copyfileobj(fileobj, self._f, self._blockSize)
+            return
+        for chunk in iter(functools.partial(fileobj.read, self._blockSize), ''):
+            self._f.write(chunk)
+            self._tee.write(chunk)
+
+    def flush(self):
+        if self._buffer:
+            text = ''.join(self._buffer)
+            self._f.write(text)
+            if self._tee is not None:
+                self._tee.write(text)
+            self._buffer = []
+            self._size = 0
+
+    def close(self):
+        self.flush()
+        if self._tee is not None:
+            self._tee.close()
+        self._f.close()
+
+    @staticmethod
+    def format_data(data):
+        """Return LCOV text for the body of a record:  'data' is a
+        FileCoverage."""
+        out = []
+        # branch data:  one run of BRDA entries per line
+        brLines = data.brLines
+        brIds = data.brIds
+        taken = data.taken
+        exprs = data.brExprs
+        notEvaluated = data.notEvaluated
+        simple = (not exprs and not notEvaluated and
+                  not any(b & 1 for b in brIds))
+        for lineNo, entries in itertools.groupby(zip(brLines, brIds, taken),
+                                                 key=operator.itemgetter(0)):
+            prefix = "BRDA:%d," % lineNo
+            if simple:
+                out.append(''.join([prefix + "%d,%d,%d\n" % (
+                    b >> 21, (b >> 1) & 0xFFFFF, t) for _, b, t in entries]))
+                continue
+            for _, b, t in entries:
+                key = (lineNo, b)
+                out.append("%s%s%d,%s,%s\n" % (
+                    prefix, 'e' if b & 1 else '', b >> 21,
+                    exprs[key] if exprs and key in exprs else
+                    (b >> 1) & 0xFFFFF,
+                    '-' if notEvaluated and key in notEvaluated else t))
+        brHit = len(taken) - taken.count(0)
+
+        # function data:  one FNL per location, followed by its aliases.
+        #  As in lcov, a location is identified by its first line - and
+        #  extends to the highest last line of any of its aliases.
+        locations = {}
+        for f in data.functions:
+            locations.setdefault(f.start, []).append(f)
+        fnHit = 0
+        for idx, (start, aliases) in enumerate(locations.items()):
+            end = max((f.end for f in aliases if f.end is not None),
+                      default=None)
+            if end is None:
+                out.append("FNL:%d,%d\n" % (idx, start))
+            else:
+                out.append("FNL:%d,%d,%d\n" % (idx, start, end))
+            out.append(''.join(["FNA:%d,%d,%s\n" % (idx, f.hit, f.name)
+                                for f in aliases]))
+            if any(f.hit for f in aliases):
+                fnHit += 1
+
+        # line data
+        lines = data.lines
+        hits = data.hits
+        checksums = data.checksums
+        if checksums:
+            out.append(''.join([
+                "DA:%d,%d,%s\n" % (lineNo, hit, checksum)
+                if checksum is not None else
+                "DA:%d,%d\n" % (lineNo, hit)
+                for lineNo, hit, checksum in zip(lines, hits, checksums)]))
+        else:
+            out.append(''.join(["DA:%d,%d\n" % lh for lh in zip(lines, hits)]))
+        lineHit = len(hits) - hits.count(0)
+
+        # LCOV totals - not used by lcov, but maybe somebody does
+        for found, hit, tags in ((len(lines), lineHit, ('LF', 'LH')),
+                                 (len(taken), brHit, ('BRF', 'BRH')),
+                                 (len(locations), fnHit, ('FNF', 'FNH'))):
+            if found == 0:
+                continue
+            out.append("%s:%d\n%s:%d\n" % (tags[0], found, tags[1], hit))
+        return ''.join(out)
+
+
+class _RangeReader:
+    """Read-only file object:  the given (start, end) byte ranges of binary
+    file 'f', as one stream - e.g., one shard of a large XML file."""
+
+    def __init__(self, f, ranges):
+        self._f = f
+        self._ranges = collections.deque(ranges)
+
+    def read(self, size=-1):
+        while self._ranges:
+            start, end = self._ranges[0]
+            n = end - start if size < 0 else min(size, end - start)
+            if n > 0:
+                self._f.seek(start)
+                data = self._f.read(n)
+                if data:
+                    self._ranges[0] = (start + len(data), end)
+                    return data
+            self._ranges.popleft()
+        return b''
+
+
+def _convert_input(scriptArgs, inputFile, fragment, ranges=None):
+    # parallel worker:  translate one input - or one shard of an XML input
+    #   (see ProcessFile._xml_shards) - to a (headerless) .info fragment.
+    # In merge mode, return the data instead:  the parent merges it and
+    #   looks up the versions.
+    import copy
+    args = copy.copy(scriptArgs)
+    args.output = fragment
+    args.parallel = 1
+    if args.merge:
+        args.version = None
+    p = ProcessFile(args, header=False)
+    if ranges is not None and p._fragments:
+        # the parent caches the translation of the whole input
+        p._notes = FragmentCache.notes()
+    p.process_input(inputFile, ranges)
+    merged = p._merged_data()
+    # the parent saves the profile data, and checks that the XML source
+    #   paths of sharded inputs are used
+    profile = p._profile.data if p._profile else None
+    p._profile = None
+    sourceUsage = p._sourceUsage
+    notes = p._notes
+    p.close()
+    return merged, profile, sourceUsage, notes
+
+
 class ProcessFile:
     """Expected/support scriptArgs:
     args.input     : name of XML file
     args.outf      : output FILE handle (written to)
     args.testName  : LCOV test name (optional) - see 'man lcov'
+    args.includePatterns :
+                     comma-separated list of glob patterns - only matching
+                     files are translated
     args.excludePatterns :
                      comma-separated list of glob patterns
     args.verbose   : verbosity
     args.version   : version script callback
+    args.versionBatch :
+                     version script supports the batch protocol - see
+                     VersionScript
+    args.versionJobs : number of version script calls to run in parallel
     args.checksum  : compute base64 checksum for each line - see 'man lcov'
+    args.profile   : name of JSON file to save timing data to - '' to use
+                     output file name + '.json', None if not profiling
+    args.cacheDir  : directory for persistent caches (line checksums and
+                     translated data of unchanged inputs) - may be None
+    args.argv      : command line arguments of the job, recorded in the
+                     profile - optional, default: sys.argv
     args.isPython  : input XML file came from Coverage.py - so apply certain
                      Python-specific derivations.
     args.deriveFunctions :
                      derive function coverpoints (primarily useful for Python -
                      see 'py2lcov --help' and the Coverage.py documentation
-    args.tabWidth  : tab width to assume when deriving information from indentation -
-                     used during Python function derivation.
+    args.tabwidth  : tab width to assume when deriving information from indentation -
+                     used during Python function derivation, if the source
+                     cannot be parsed by the 'ast' module.
     args.keepGoing : do not stop when error or inconsistency is detected
+    args.parallel  : number of inputs to translate in parallel (0: number
+                     of CPUs)
+    args.shard     : with 'parallel':  split large XML inputs at <package>
+                     boundaries, and translate the pieces in parallel
+    args.merge     : combine the data for each source file found in any of
+                     the inputs into a single record
 
     """
 
@@ -96,177 +1400,604 @@ This is a problem in at least 2 ways:
     Thus, the combined result in the above example would claim 4 of 8
     branches hit.
     This definition turns out to be a lower bound.
+
+When Coverage.py data files are read directly (rather than by way of XML),
+the arc data is used instead:  each branch is one exit from the line, and
+the data of different runs merges exactly.
 """
 
-    def __init__(self, scriptArgs):
+    def __init__(self, scriptArgs, header=True, caches=None):
         self._args = scriptArgs
+        # 'caches' is shared with other jobs - e.g., by 'serve'
+        self._sharedCaches = caches is not None
+        self._caches = caches if caches is not None else ConverterCaches()
 
-        self._excludePatterns = scriptArgs.excludePatterns.split(',') if scriptArgs.excludePatterns else None
+        self._filter = PathFilter(
+            scriptArgs.includePatterns.split(',') if scriptArgs.includePatterns else None,
+            scriptArgs.excludePatterns.split(',') if scriptArgs.excludePatterns else None)
         self._versionScript = scriptArgs.version.split(',') if scriptArgs.version else None
+        # (cmd, batch, jobs) of the VersionScript - started when first
+        #   used (see '_version_script'):  e.g., the parent of parallel
+        #   workers does not need it
+        self._versionCmd = None
+        self._versions = None
         if self._versionScript and self._versionScript[0][-3:] == ".pm":
-            # hard to handle Perl module in python - so we hack it
-            self._vesionModule = self._versionScript
-            self._versionScript = None
+            # Perl module:  load it just once, in a helper process which
+            #   speaks the batch protocol
+            helper = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'versionhelper.pl')
+            self._versionCmd = ([helper] + self._versionScript, True, 1)
+        elif self._versionScript:
+            if scriptArgs.versionBatch:
+                self._versionCmd = (self._versionScript + ['--batch'], True, 1)
+            else:
+                self._versionCmd = (self._versionScript, False,
+                                    scriptArgs.versionJobs)
+        # records waiting for their version string
+        self._pending = collections.deque()
 
-        self._outf = open(scriptArgs.output, "w")
+        # merge mode:  source file name -> coverage data accumulator (see
+        #   'coverage_sum'), written at the end
+        self._merged = {} if scriptArgs.merge else None
+        self._resolver = self._caches.resolver
+        self._scopes = self._caches.scopes
+        self._sources = self._caches.sources
+        self._checksums = self._caches.checksums(scriptArgs.cacheDir)
+        self._fragments = None
+        if scriptArgs.cacheDir and not (self._versionScript or scriptArgs.merge):
+            # version strings depend on the environment, not just on the
+            #   input - so are not cached.
+            # merge mode needs the data, not the LCOV text.
+            self._fragments = FragmentCache(
+                scriptArgs.cacheDir,
+                (getattr(scriptArgs, 'isPython', False), scriptArgs.checksum,
+                 getattr(scriptArgs, 'deriveFunctions', False),
+                 getattr(scriptArgs, 'tabwidth', None),
+                 scriptArgs.includePatterns, scriptArgs.excludePatterns))
+        self._profile = Profile(getattr(scriptArgs, 'argv', None)) \
+            if scriptArgs.profile is not None else None
+        self._sourceUsage = None
+        # see FragmentCache.notes - while translating a cacheable input
+        self._notes = None
+        self._outf = LcovWriter(scriptArgs.output)
         try:
             self._isPython = scriptArgs.isPython
         except:
             self._isPython = False
 
-        self._outf.write("TN:%s\n" % scriptArgs.testName)
+        if header:
+            self._outf.header(scriptArgs.testName)
 
     def close(self):
 
+        if self._merged:
+            self._write_merged()
+        self._flush_pending()
+        if not self._sharedCaches:
+            self._caches.close()
         self._outf.close()
+        self._checksums.prune()
+        if self._fragments:
+            self._fragments.prune()
+        if self._args.verbose:
+            self._filter.report()
+            self._resolver.report()
+            self._sources.report()
+            if self._isPython:
+                self._scopes.report()
+            if self._args.checksum:
+                self._checksums.report()
+            if self._fragments:
+                self._fragments.report()
+        if self._profile:
+            self._profile.save(self._args.profile or self._args.output + '.json',
+                               self._args.parallel or os.cpu_count() or 1)
 
-        if self._args.version and None == self._versionScript:
-            cmd = "%(lcov)s -a %(info)s -o %(info)s --version-script '%(vers)s' %(checksum)s--rc compute_file_version=1" % {
-                'lcov': os.path.join(os.path.split(sys.argv[0])[0], 'lcov'),
-                'checksum': "--checksum " if self._args.checksum else '',
-                'info': self._args.output,
-                'vers' : self._args.version,
-            }
-            try:
-                x = subprocess.run(cmd, shell=True, check=True, stdout=True, stderr=True)
-            except subprocess.CalledProcessError as err:
-                print("Error during lcov version append operation: %s" % (
-                    str(err)))
-                if not self._args.keepGoing:
-                    sys.exit(1);
+    def process_inputs(self, inputs):
+        """Translate each of 'inputs' - in parallel, if requested.
+        The result is identical to translating them one after another."""
+        jobs = self._args.parallel
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        # each task is (input, shard byte ranges or None, is last shard)
+        tasks = []
+        sharded = {}     # input -> fragment cache key (or None)
+        for f in inputs:
+            shards = None
+            if jobs > 1 and getattr(self._args, 'shard', False):
+                shards = self._xml_shards(f, jobs * self._shardsPerJob)
+            if not shards:
+                tasks.append((f, None, True))
+                continue
+            key = self._fragment_key(f)
+            if key and self._fragments.get(key, count=False) is not None:
+                # cached:  no need to split it
+                tasks.append((f, None, True))
+                continue
+            if self._args.verbose:
+                print("translating %s in %d shards" % (f, len(shards)))
+            sharded[f] = key
+            tasks.extend((f, ranges, idx + 1 == len(shards))
+                         for idx, ranges in enumerate(shards))
+        jobs = min(jobs, len(tasks))
+        if jobs <= 1:
+            for f in inputs:
+                self.process_input(f)
+            return
 
+        import concurrent.futures
+        import shutil
+        import tempfile
+        self._flush_pending()
+        tmpdir = tempfile.mkdtemp(prefix='xml2lcov')
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+                fragments = []
+                for idx, (f, ranges, last) in enumerate(tasks):
+                    fragment = os.path.join(tmpdir, "%d.info" % idx)
+                    fragments.append((pool.submit(_convert_input, self._args,
+                                                  f, fragment, ranges),
+                                      fragment, f, ranges, last))
+                # concatenate the results in input order
+                inShards = False
+                sourceUsage = None
+                for future, fragment, f, ranges, last in fragments:
+                    merged, profile, usage, notes = future.result()
+                    if profile:
+                        self._profile.merge(profile)
+                    if ranges is not None and not inShards:
+                        # first shard of this input
+                        inShards = True
+                        if sharded[f]:
+                            self._outf.capture(
+                                self._fragments.fragment_file(sharded[f]))
+                            self._notes = FragmentCache.notes()
+                    if notes and self._notes:
+                        FragmentCache.merge_notes(self._notes, notes)
+                    if usage:
+                        if sourceUsage is None:
+                            sourceUsage = usage
+                        else:
+                            for s, u in zip(sourceUsage, usage):
+                                s[1] += u[1]
+                    if merged is not None:
+                        for name, data in merged.items():
+                            self._write_record(name, data)
+                    else:
+                        with open(fragment, 'r') as frag:
+                            self._outf.copy(frag)
+                    if ranges is not None and last:
+                        self._check_source_paths(f, sourceUsage or [])
+                        if sharded[f]:
+                            self._outf.end_capture()
+                            self._fragments.put(sharded[f], self._notes)
+                            self._notes = None
+                        inShards = False
+                        sourceUsage = None
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
 
-    def process_xml_file(self, xml_file):
+    # with '--shard':  split large XML inputs into (at most) this many shards
+    #   per parallel job - so the load stays balanced when package sizes
+    #   differ - but into shards no smaller than '_minShardSize' bytes
+    _shardsPerJob = 4
+    _minShardSize = 1 << 20
 
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        source_paths = []
+    @classmethod
+    def _xml_shards(cls, filename, count):
+        """Return list of shards of XML file 'filename' - each a list of
+        (start, end) byte ranges which form a valid XML document:  the
+        header up to the first <package>, a run of complete <package>
+        elements, and the trailer from </packages> onwards.
+        Return None if the file should not (or cannot) be split:  e.g.,
+        if it is small, compressed, or not in the expected format."""
+        if (strip_compressed_suffix(filename) != filename or
+                not filename.endswith('.xml')):
+            return None
+        try:
+            size = os.path.getsize(filename)
+            if size < 2 * cls._minShardSize:
+                return None
+            import mmap
+            with open(filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    end = m.rfind(b'</packages>')
+                    offsets = [p.start() for p in
+                               re.finditer(rb'<package[\s>/]', m)]
+        except (OSError, ValueError):
+            return None
+        offsets = [o for o in offsets if o < end]
+        if len(offsets) < 2:
+            return None
+        header = (0, offsets[0])
+        trailer = (end, size)
+        target = max(cls._minShardSize, (end - offsets[0]) // count)
+        shards = []
+        start = offsets[0]
+        for o in offsets[1:]:
+            if o - start >= target:
+                shards.append([header, (start, o), trailer])
+                start = o
+        shards.append([header, (start, end), trailer])
+        return shards if len(shards) > 1 else None
+
+    def process_input(self, filename, ranges=None):
+        start = time.perf_counter()
+        if ranges is not None:
+            # one shard of a large XML file - see '_xml_shards'
+            self.process_xml_file(filename, ranges)
+        else:
+            self._process_input(filename)
+        if self._profile:
+            # whole input - including the 'file', 'resolve', ... times of
+            #   each source file it contains
+            self._profile.add('input', filename, time.perf_counter() - start)
+
+    # Coverage.py configuration files - see 'coverage.Coverage(config_file=True)'
+    _coverageConfigFiles = ('.coveragerc', 'setup.cfg', 'tox.ini', 'pyproject.toml')
+
+    def _is_data_file(self, filename):
+        # assume that anything not ending in .xml is a Coverage.py data file
+        return (self._isPython and
+                os.path.splitext(strip_compressed_suffix(filename))[1] != '.xml')
+
+    def _fragment_key(self, filename):
+        if not self._fragments:
+            return None
+        configFiles = ()
+        if self._is_data_file(filename):
+            # the configuration selects the lines to report (e.g., 'exclude_lines')
+            configFiles = self._coverageConfigFiles
+            if 'COVERAGE_RCFILE' in os.environ:
+                configFiles = (os.environ['COVERAGE_RCFILE'],) + configFiles
+        return self._fragments.key(filename, configFiles)
+
+    def _process_input(self, filename):
+        key = self._fragment_key(filename)
+        if key:
+            cached = self._fragments.get(key)
+            if cached is not None:
+                if self._args.verbose:
+                    print("using cached translation of %s" % filename)
+                fragment, warnings = cached
+                for message in warnings:
+                    print(message)
+                with open(fragment, 'r') as f:
+                    self._outf.copy(f)
+                return
+            self._outf.capture(self._fragments.fragment_file(key))
+            self._notes = FragmentCache.notes()
+        self._translate_input(filename)
+        if key:
+            self._outf.end_capture()
+            self._fragments.put(key, self._notes)
+            self._notes = None
+
+    def _warn(self, message):
+        # print warning - and repeat it when the cached translation is used
+        print(message)
+        if self._notes is not None:
+            self._notes['warnings'].append(message)
+
+    def _error(self, message):
+        # print error, and exit unless '--keep-going'
+        print(message)
+        if self._notes is not None:
+            self._notes['failed'] = True
+        if not self._args.keepGoing:
+            sys.exit(1)
+
+    def _translate_input(self, filename):
+        if self._is_data_file(filename):
+            self.process_data_file(filename)
+        else:
+            self.process_xml_file(filename)
+
+    def process_xml_file(self, xml_file, ranges=None):
 
+        # The XML data is streamed rather than read into a tree:  each <class>
+        #   element is translated as soon as its end tag is seen, and then
+        #   discarded - so memory use stays flat, regardless of the size of
+        #   the input.
+        # A source file with several classes (e.g., Java inner classes)
+        #   has one <class> element for each:  their data is combined, and
+        #   written as one record at the end of the <package>.
+        # Expected structure:
+        #   <coverage> <sources> <source/>* </sources>
+        #              <packages> <package> <classes> <class/>*
+        source_paths = []
+        stack = []       # currently open elements - stack[0] is the root
+        topLevel = []    # tags of the children of the root element
+        isExternal = False
+        records = {}     # source file -> data, of the current <package>
+        import xml.etree.ElementTree as ET
         try:
-            if(root[0].tag == 'sources'):
-                for source in root[0]:
-                    # keep track of number of times we use each source_path to find
-                    #  some file.  Unused source paths are likely a problem.
-                    source_paths.append([source.text, 0])
-                    if self._args.verbose:
-                        print("source: " + source.text)
-            else:
-                print("Error: parse xml fail: no 'sources' in %s" %(xml_file))
-                sys.exit(1)
-            if(root[1].tag == 'packages'):
-                if (self._args.verbose):
-                    print("packages: " + str(root[1].attrib))
-            else:
-                print("Error: parse xml fail: no 'packages' in %s" %(xml_file))
-                sys.exit(1)
-        except Exception as err:
-            print("Error: parse xml fail in %s: %s" % (xml_file, str(err)))
-            if not self._args.keepGoing:
-                sys.exit(1)
+            with open_file(xml_file, 'rb') as xmlData:
+                if ranges is not None:
+                    xmlData = _RangeReader(xmlData, ranges)
+                for event, elem in ET.iterparse(xmlData, events=('start', 'end')):
+                    if event == 'start':
+                        stack.append(elem)
+                        depth = len(stack)
+                        if depth == 2:
+                            topLevel.append(elem.tag)
+                            if len(topLevel) == 1 and elem.tag != 'sources':
+                                print("Error: parse xml fail: no 'sources' in %s" %(xml_file))
+                                sys.exit(1)
+                            if len(topLevel) == 2:
+                                if elem.tag != 'packages':
+                                    print("Error: parse xml fail: no 'packages' in %s" %(xml_file))
+                                    sys.exit(1)
+                                if (self._args.verbose):
+                                    print("packages: " + str(elem.attrib))
+                        elif depth == 3 and len(topLevel) == 2:
+                            # name="." means current directory
+                            # name=".folder1.folder2" means external module or directory
+                            # name="abc" means internal module or directory
+                            name = elem.attrib['name']
+                            isExternal = (name.startswith('.') and name != '.')
+                        continue
+
+                    # end tag
+                    stack.pop()
+                    depth = len(stack)
+                    if depth == 1 and len(topLevel) == 1:
+                        # end of 'sources'
+                        for source in elem:
+                            # keep track of number of times we use each source_path to find
+                            #  some file.  Unused source paths are likely a problem.
+                            source_paths.append([source.text, 0])
+                            if self._args.verbose:
+                                print("source: " + source.text)
+                    elif len(topLevel) == 2:
+                        if depth == 4:
+                            self._process_class(elem, isExternal, source_paths,
+                                                records)
+                        elif depth == 2:
+                            # end of <package>
+                            self._write_records(records)
+                        if 2 <= depth <= 4:
+                            # done with this <class> or <package> - drop it
+                            stack[-1].remove(elem)
+        except (ET.ParseError, OSError, EOFError) + decompress_errors() as err:
+            self._write_records(records)
+            self._error("Error: parse xml fail in %s: %s" % (xml_file, str(err)))
             return
 
-        for package in root[1]:
-            # name="." means current directory
-            # name=".folder1.folder2" means external module or directory
-            # name="abc" means internal module or directory
-            isExternal = (package.attrib['name'].startswith('.') and package.attrib['name'] != '.')
-            #pdb.set_trace()
-            for classes in package:
-                for fileNode in classes:
-                    if self._args.excludePatterns and any([fnmatch.fnmatchcase(fileNode.attrib['filename'], ef) for ef in self._excludePatterns]):
-                        if self._args.verbose:
-                            print("%s is excluded" % fileNode.attrib['filename'])
-                        continue
-                    name = fileNode.attrib['filename']
-                    if not isExternal:
-                        for s in source_paths:
-                            path = os.path.join(s[0], name)
-                            if os.path.exists(path):
-                                name = path
-                                s[1] += 1 # this source path used for something
-                                break
-                        else:
-                            print("did not find %s in search path" % (path))
+        if len(topLevel) < 2:
+            self._error("Error: parse xml fail in %s: %s" % (
+                xml_file, "no 'packages' found"))
+            return
 
-                    self._outf.write("SF:%s\n" % name)
-                    if self._versionScript:
-                        cmd = copy.deepcopy(self._versionScript)
-                        cmd.append(name)
-                        try:
-                            version = subprocess.check_output(cmd)
-                            self._outf.write("VER:%s\n" % version.strip().decode('UTF-8'))
-                        except Exception as err:
-                            print("Error: no version for %s: %s" %(
-                                name, str(err)))
-                            if not self._args.keepGoing:
-                                sys.exit(-1)
+        self._flush_pending()
 
-                    self.process_file(fileNode, name)
-                    self._outf.write("end_of_record\n")
+        if ranges is not None:
+            # the parent checks the usage counts of all the shards
+            self._sourceUsage = source_paths
+        else:
+            self._check_source_paths(xml_file, source_paths)
 
+    def _check_source_paths(self, xml_file, source_paths):
         for s in source_paths:
             if s[1] == 0:
-                print("Warning: XM file '%s': source_path '%s' is unused" %(xml_file, s[0]))
+                self._warn("Warning: XM file '%s': source_path '%s' is unused" %(xml_file, s[0]))
 
+    def _is_excluded(self, filename):
+        if self._filter.is_excluded(filename):
+            if self._args.verbose:
+                print("%s is excluded" % filename)
+            return True
+        return False
 
-    def process_file(self, fileNode, filename):
+    def _write_records(self, records):
+        for name, data in records.items():
+            self._write_record(name, data)
+        records.clear()
 
-        sourceCode = None
-        if (self._args.checksum or
-            (self._isPython and self._args.deriveFunctions)):
+    def _process_class(self, fileNode, isExternal, source_paths, records):
+
+        if self._is_excluded(fileNode.attrib['filename']):
+            return
+        name = fileNode.attrib['filename']
+        if not isExternal:
+            start = time.perf_counter()
+            roots = tuple(s[0] for s in source_paths)
+            idx = self._resolver.resolve(roots, name)
+            if self._notes is not None:
+                # the result depends on the directories searched
+                self._notes['dirs'].update(
+                    os.path.dirname(os.path.join(root, name))
+                    for root in roots[:len(roots) if idx is None else idx + 1])
+            if idx is not None:
+                name = os.path.join(roots[idx], name)
+                source_paths[idx][1] += 1 # this source path used for something
+            else:
+                self._warn("did not find %s in search path" % (
+                    os.path.join(roots[-1], name) if roots else name))
+            if self._profile:
+                self._profile.add('resolve', name, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        data = self.process_file(fileNode, name)
+        if self._profile:
+            self._profile.add('file', name, time.perf_counter() - start)
+        if data is None:
+            return
+        if name in records:
+            records[name].merge(data)
+        else:
+            records[name] = data
+
+    def _write_record(self, name, data):
+        if data is None:
+            return
+        if self._merged is not None:
+            # write all the merged data at the end
+            if name in self._merged:
+                self._merged[name].merge(data)
+            else:
+                self._merged[name] = coverage_sum(data)
+            return
+
+        start = time.perf_counter()
+        body = LcovWriter.format_data(data)
+        versions = self._version_script()
+        if versions:
+            # version lookup may run in the background - so hold on to
+            #  this record until its version is available.
+            self._pending.append((name, versions.submit(name), body))
+        else:
+            self._outf.record(name, body)
+        if self._profile:
+            self._profile.add('write', name, time.perf_counter() - start)
+        if versions:
+            self._flush_pending(versions.window)
+
+    def _version_script(self):
+        # return the VersionScript - or None, if there is no
+        #   '--version-script'
+        if self._versions is None and self._versionCmd:
+            cmd, batch, jobs = self._versionCmd
+            try:
+                self._versions = self._caches.versions(cmd, batch=batch,
+                                                       jobs=jobs)
+            except OSError as err:
+                # don't try again - with '-k', continue without versions
+                self._versionCmd = None
+                self._error("Error: unable to run version script '%s': %s" % (
+                    ' '.join(cmd), str(err)))
+        return self._versions
+
+    def _merged_data(self):
+        # return the merge mode data - source file name -> FileCoverage -
+        #  and stop merging
+        merged = self._merged
+        self._merged = None
+        if merged is None:
+            return None
+        return {name : acc.result() for name, acc in merged.items()}
+
+    def _write_merged(self):
+        for name, data in self._merged_data().items():
+            self._write_record(name, data)
+        self._merged = {}
+
+    def _flush_pending(self, keep=0):
+        # write all but the last 'keep' pending records
+        while len(self._pending) > keep:
+            name, version, body = self._pending.popleft()
+            v = None
+            start = time.perf_counter()
             try:
-                with open(filename, 'r') as f:
-                    sourceCode = f.read().split('\n')
-            except:
-                feature = ' compute line checksum' if self._args.checksum else ''
-                if self._isPython and self._args.deriveFunctions:
-                   if feature != '':
-                      feature += ' or'
-                   feature += ' derive function data'
-
-                print("cannot open %s - unable to %s" % (filename, feature));
+                v = version()
+            except Exception as err:
+                print("Error: no version for %s: %s" %(
+                    name, str(err)))
                 if not self._args.keepGoing:
-                    sys.exit(1)
+                    sys.exit(-1)
+            if self._profile:
+                # time spent waiting for the version - not total lookup time
+                self._profile.add('version', name, time.perf_counter() - start)
+            self._outf.record(name, body, v)
 
-        def count(indent):
-            count = 0
-            for c in indent:
-                if c == ' ':
-                    count += 1
+    def process_data_file(self, data_file):
+        """Read a Coverage.py data file directly - rather than by way of
+        'coverage xml' and an intermediate XML file."""
+        try:
+            import coverage
+            try:
+                from coverage.report_core import get_analysis_to_report
+            except ImportError:
+                # older Coverage.py versions
+                from coverage.report import get_analysis_to_report
+            try:
+                from coverage.misc import human_key
+            except ImportError:
+                human_key = lambda s: s
+
+            cov = coverage.Coverage(data_file=data_file)
+            cov.load()
+            hasArcs = cov.get_data().has_arcs()
+            # Emit files in the same order as 'coverage xml' does:
+            #   by package (directory), then by filename
+            sources = set(os.path.abspath(s).rstrip(os.sep) for s in
+                          (cov.config.source or []) if os.path.exists(s))
+            files = []
+            for fr, analysis in get_analysis_to_report(cov, None):
+                if cov.config.skip_empty and not analysis.statements:
+                    continue
+                filename = fr.filename.replace("\\", "/")
+                for src in sources:
+                    if filename.startswith(src.replace("\\", "/") + "/"):
+                        relName = filename[len(src) + 1:]
+                        break
                 else:
-                    assert(c == '\t') # shouldn't be anything but space or tab
-                    count += self._args.tabWidth
-            return count
+                    relName = fr.relative_filename().replace("\\", "/")
+                    sources.add(fr.filename[:-len(relName)].rstrip("\\/"))
+                branchStats = analysis.branch_stats() if hasArcs else {}
+                arcs = self._branch_arcs(analysis) if hasArcs else {}
+                lines = []
+                for lineNo in sorted(analysis.statements):
+                    branch = None
+                    if lineNo in branchStats:
+                        total, taken = branchStats[lineNo]
+                        branch = arcs.get(lineNo)
+                        if (branch is None or len(branch) != total or
+                            sum(branch) != taken):
+                            branch = (taken, total)
+                    lines.append((lineNo, int(lineNo not in analysis.missing),
+                                  branch))
+                package = (os.path.dirname(relName) or '.').replace('/', '.')
+                files.append(((human_key(package), human_key(relName)),
+                              relName, fr.filename, lines))
+        except Exception as err:
+            self._error("Error: unable to read Coverage.py data file %s: %s" % (
+                data_file, str(err)))
+            return
 
-        def buildFunction(functions, objStack, currentObj, lastLine):
-            if currentObj and prevLine:
-                currentObj['end'] = lastLine # last line
-                prefix = ''
-                sep = ''
-                for e in objStack:
-                    prefix += sep + e['name']
-                    sep = "::" if e['type'] == 'class' else '.'
-                if currentObj['type'] == 'def':
-                    fullname = prefix + sep + currentObj['name']
-                    # function might be unreachable dead code
-                    try:
-                        hit = currentObj['hit']
-                    except:
-                        hit = 0
-                    functions.append({'name'  : fullname,
-                                      'start' : currentObj['start'],
-                                      'end'   : currentObj['end'],
-                                      'hit'   : hit})
+        files.sort(key=lambda f: f[0])
+        for key, relName, name, lines in files:
+            if self._is_excluded(relName):
+                continue
+            start = time.perf_counter()
+            data = self.process_lines(name, [], lines)
+            if self._profile:
+                self._profile.add('file', name, time.perf_counter() - start)
+            self._write_record(name, data)
+        self._flush_pending()
 
-        # just collect the function/class name - ignore the params
-        parseLine = re.compile('(\s*)((def|class)\s*([^\( \t]+))?')
-        #parseLine = re.compile('(\s*)((def|class)\s*([^:]+)(:|$))?')
+    @staticmethod
+    def _branch_arcs(analysis):
+        # Coverage.py arc data:  return dict of line -> list of 0/1 taken
+        #  flags, one per exit from that line.  The exits are ordered by
+        #  destination line - so each exit has the same branch index in
+        #  every run, and the data of different runs can be merged exactly.
+        try:
+            executed = analysis.executed_branch_arcs()
+            missing = analysis.missing_branch_arcs()
+        except AttributeError:
+            # older Coverage.py versions
+            return {}
+        arcs = {}
+        for lineNo in set(executed) | set(missing):
+            exits = sorted([(dest, 1) for dest in executed.get(lineNo, ())] +
+                           [(dest, 0) for dest in missing.get(lineNo, ())])
+            arcs[lineNo] = [taken for dest, taken in exits]
+        return arcs
+
+    def process_file(self, fileNode, filename):
 
         # no information about actual branch expressions/branch
         #  coverage - only the percentage and number hit/not hit
         parseCondition = re.compile(r'\d+\% \((\d+)/(\d+)\)')
 
         functions = [] # list of [functionName startLine endLine hitcout]
+        # line data found in <methods> - keyed by the 'number' attribute
+        #   string, as found in the XML.  This data is authoritative:  the
+        #   same lines in the class <lines> element are not parsed again.
+        methodLines = {}
+        shared = set() # lines which appear in more than one method
+        data = None
         for node in fileNode:
 
             if node.tag == 'methods':
@@ -280,201 +2011,441 @@ This is a problem in at least 2 ways:
                         first = None
                         last = None
                         hit = 0
-                        if lines.tag == 'lines':
-                            # might want to hang onto the method lines - and
-                            #   check that the 'lines' tag we find in the parent
-                            #   node contains all of the method lines we found
-                            functionLines = {}
-                            branches = {}
-                            for l in lines:
-                                lineNum = int(l.attrib['number'])
-                                lineHit = int(l.attrib['hits'])
-                                functionLines[lineNum] = lineHit
-                                if first == None:
-                                    first = lineNum
-                                    last = lineNum
-                                    hit = lineHit
-                                else:
-                                    assert(lineNum > last)
-                                    last = lineNum;
-                                if 'branch' in l.attrib and 'true' == l.attrib['branch']:
-                                    assert('condition-coverage' in l.attrib)
-                                    m = parseCondition.search(l.attrib['condition-coverage'])
-                                    assert(m)
-                                    # [taken total]
-                                    branches[lineNum] = [m.group(1), m.group(2)]
+                        for l in lines:
+                            number = l.attrib['number']
+                            lineNum = int(number)
+                            lineHit = int(l.attrib['hits'])
+                            if first == None:
+                                first = lineNum
+                                last = lineNum
+                                hit = lineHit
+                            else:
+                                assert(lineNum > last)
+                                last = lineNum;
+                            branch = None
+                            if 'branch' in l.attrib and 'true' == l.attrib['branch']:
+                                assert('condition-coverage' in l.attrib)
+                                m = parseCondition.search(l.attrib['condition-coverage'])
+                                assert(m)
+                                branch = (int(m.group(1)), int(m.group(2)))
+                            if number in methodLines:
+                                shared.add(number)
+                            methodLines[number] = (lineNum, lineHit, branch)
 
                         if first != None:
-                            functions.append({'name'  : func,
-                                              'start' : first,
-                                              'end'   : last,
-                                              'hit'   : hit,
-                                              'lines' : functionLines,
-                                              'branches' : branches})
+                            functions.append(FunctionCoverage(func, first,
+                                                              last, hit))
                         elif self._args.verbose:
                             # there seem to be a fair few functions
                             #  which contain no data
                             print("elided empty function %s" %(func))
 
+                # lines shared by several methods (e.g., lambdas) might have
+                #  different counts in each - so use the class data for those
+                for number in shared:
+                    del methodLines[number]
                 continue
 
             if node.tag != 'lines':
-                print("not handling tag %s" %(node.tag))
+                self._warn("not handling tag %s" %(node.tag))
                 continue
 
-            # Keep track of current function/class scope - which we use to find
-            #   the first and last executable lines in each function,
-            # Want to keep track of the function end line - so we can use lcov
-            # function exclusions.
-            #   currentObj:
-            #    type:   'class' or 'def'
-            #    name:   as appears in regexp
-            #    indent: indent count of 'def' or 'class' statement
-            #    start:  line of item (where 'def' or 'class' is found
-            #    end:    last line of function
-            #    hit:    whether first line of function is hit or not
-            currentObj = None # {type name startIndent lineNo first end start}
-            objStack = []
-            prevLine = None
-            totals = { 'line' : [0, 0, 'LF', 'LH'],
-                       'branch' : [0, 0, 'BRF', 'BRH'],
-                       'function' : [0, 0, 'FNF', 'FNH'],
-            }
-            # need to save the statement data and print later because Coverage.py
-            # has an odd interpretation of the execution status of the function
-            # decl line.
-            #   - C/C++ mark it executed if the line is entered - so it
-            #     is an analog of function coverage.
-            #   - Coverage.py appears to mark it executed when the containing
-            #     scope is executed (i.e., when a lazy interpret might compile
-            #     the function).
-            # However, we want to mark the decl executed only if the function
-            # is executed - and we decide that the function is executed if first
-            # line in the function is hit.
-            #   - as a result, after seeing all the functions, we want to go back
-            #     and mark the function decl line as 'not hit' if we decided that
-            #     the function itself is not executed.
-            lineData = {}
+            lines = []
+            found = 0
             for line in node:
-                lineNo = int(line.attrib['number'])
-                hit = int(line.attrib["hits"])
-                lineData[lineNo] = hit;
-
-                totals['line'][0] += 1
-                if hit:
-                    totals['line'][1] += 1
-                if sourceCode and self._isPython:
-                    # try to derive function names and begin/end lines in Python code
-                    if lineNo <= len(sourceCode):
-                        m = parseLine.search(sourceCode[lineNo-1])
-                        if m:
-                            indent = count(m.group(1))
-                            #print(sourceCode[lineNo-1])
-                            while currentObj and indent <= currentObj['indent']:
-                                # lower indent - so this is a new object
-                                #print("build " + currentObj['name'])
-                                buildFunction(functions, objStack,
-                                              currentObj, prevLine)
-
-                                try:
-                                    currentObj = objStack.pop()
-                                except IndexError as err:
-                                    currentObj = None
-                                    break
-
-                            if m.group(2):
-                                if currentObj:
-                                    objStack.append(currentObj)
-                                objtype = m.group(3)
-                                name = m.group(4).rstrip()
-                                if (-1 != name.find('(') and
-                                    ')' != name[-1]):
-                                    name += '...)'
-                                currentObj = { 'type':   objtype,
-                                               'name':   name,
-                                               'indent': indent,
-                                               'start':  lineNo,
-                                }
-                            else:
-                                # just a line - may be the first executable
-                                #   line in some function:
-                                if currentObj and not 'hit' in currentObj:
-                                    currentObj['hit'] = hit
-                                    # mark that function decl line is not
-                                    #  hit if the function is not hit
-                                    if 0 == hit:
-                                        assert(currentObj['start'] in lineData)
-                                        lineData[currentObj['start']] = 0
-
-                        prevLine = lineNo
-                    else:
-                        print('"%s":%d: Error: out of range: file contains %d lines' % (
-                            filename, lineNo, len(sourceCode)))
-                        if not self._args.keepGoing:
-                            sys.exit(1)
-
+                if line.attrib['number'] in methodLines:
+                    # already have the data for this line
+                    found += 1
+                    continue
+                branch = None
                 if "branch" in line.attrib and line.attrib["branch"] == 'true':
                     # attrib is always true from xmlreport.py - but may not
                     #   be true cobertura report
                     assert('condition-coverage' in line.attrib)
                     m = parseCondition.search(line.attrib['condition-coverage'])
                     assert(m)
-                    taken = int(m.group(1))
-                    total = int(m.group(2))
-                    # no information of which clause is taken or not
-                    # set taken conditions start from 0 and followed by
-                    #  non-taken conditions
-                    # taken conditions
-                    for cond in range(0,taken):
-                        self._outf.write("BRDA:%d,0,%d,1\n" % (lineNo, cond))
-                        totals['branch'][0] += 1
-                        totals['branch'][1] += 1
-                    # non-taken conditions
-                    for cond in range(taken, total):
-                        totals['branch'][0] += 1
-                        self._outf.write("BRDA:%d,0,%d,0\n" % (lineNo, cond))
-
-            # and build all the pending functions
-            #  these were still open when we hit the end of file - e.g., because
-            #  they are last elements in some package file and there are no
-            #  no executable lines after the function decl.
-            # There may be more than one function in the stack, if the last
-            # object is nested.
-            while currentObj:
-                buildFunction(functions, objStack, currentObj, prevLine)
+                    branch = (int(m.group(1)), int(m.group(2)))
+                lines.append((int(line.attrib['number']),
+                              int(line.attrib["hits"]), branch))
+            if methodLines:
+                if found != len(methodLines) and self._args.verbose:
+                    print("%s: %d method lines not found in class <lines>" % (
+                        filename, len(methodLines) - found))
+                lines.extend(methodLines.values())
+                lines.sort(key=lambda l: l[0])
+                methodLines = {}
+            fileData = self.process_lines(filename, functions, lines)
+            if data is None:
+                data = fileData
+            else:
+                data.merge(fileData)
+        if methodLines:
+            # no <lines> element:  use the method data
+            fileData = self.process_lines(
+                filename, functions,
+                sorted(methodLines.values(), key=lambda l: l[0]))
+            if data is None:
+                data = fileData
+            else:
+                data.merge(fileData)
+        return data
+
+    def process_lines(self, filename, functions, lines):
+        """Write the LCOV data for one file.
+        functions: list of function data found in the input (possibly empty)
+        lines:     list of (lineNo, hitCount, branch) in line number order,
+                   where branch is None, (taken, total) - or list of taken
+                   counts of each branch, if known (e.g., Coverage.py arcs)
+        """
+
+        sourceCode = None
+        scopes = None
+        deriveFunctions = self._isPython and self._args.deriveFunctions
+        start = time.perf_counter()
+        if deriveFunctions:
+            source = self._sources.get(filename)
+            if source is not None:
+                sourceCode = source.lines
+                scopes = self._scopes.find(source.text)
+            else:
+                feature = ' compute line checksum or' if self._args.checksum else ''
+                self._error("cannot open %s - unable to %s derive function data" % (
+                    filename, feature))
+        deriveTime = time.perf_counter() - start
+        lineChecksums = None
+        start = time.perf_counter()
+        if self._args.checksum:
+            lineChecksums = self._checksums.get(filename)
+            if lineChecksums is None and not deriveFunctions:
+                self._error("cannot open %s - unable to  compute line checksum" % (
+                    filename))
+        checksumTime = time.perf_counter() - start
+
+        def count(indent):
+            count = 0
+            for c in indent:
+                if c == ' ':
+                    count += 1
+                else:
+                    assert(c == '\t') # shouldn't be anything but space or tab
+                    count += self._args.tabwidth
+            return count
+
+        def buildFunction(functions, objStack, currentObj, lastLine):
+            if currentObj and prevLine:
+                currentObj['end'] = lastLine # last line
+                prefix = ''
+                sep = ''
+                for e in objStack:
+                    prefix += sep + e['name']
+                    sep = "::" if e['type'] == 'class' else '.'
+                if currentObj['type'] == 'def':
+                    fullname = prefix + sep + currentObj['name']
+                    # function might be unreachable dead code
+                    try:
+                        hit = currentObj['hit']
+                    except:
+                        hit = 0
+                    functions.append(FunctionCoverage(
+                        fullname, currentObj['start'], currentObj['end'], hit))
+
+        # just collect the function/class name - ignore the params
+        parseLine = re.compile('(\s*)((def|class)\s*([^\( \t]+))?')
+        #parseLine = re.compile('(\s*)((def|class)\s*([^:]+)(:|$))?')
+
+
+        # Keep track of current function/class scope - which we use to find
+        #   the first and last executable lines in each function,
+        # Want to keep track of the function end line - so we can use lcov
+        # function exclusions.
+        #   currentObj:
+        #    type:   'class' or 'def'
+        #    name:   as appears in regexp
+        #    indent: indent count of 'def' or 'class' statement
+        #    start:  line of item (where 'def' or 'class' is found
+        #    end:    last line of function
+        #    hit:    whether first line of function is hit or not
+        currentObj = None # {type name startIndent lineNo first end start}
+        objStack = []
+        prevLine = None
+        brLines = []     # line number of each branch
+        brIds = []       # packed branch IDs - see FileCoverage.branch_id
+        taken = []       # taken count of each branch
+        # need to save the statement data and print later because Coverage.py
+        # has an odd interpretation of the execution status of the function
+        # decl line.
+        #   - C/C++ mark it executed if the line is entered - so it
+        #     is an analog of function coverage.
+        #   - Coverage.py appears to mark it executed when the containing
+        #     scope is executed (i.e., when a lazy interpret might compile
+        #     the function).
+        # However, we want to mark the decl executed only if the function
+        # is executed - and we decide that the function is executed if first
+        # line in the function is hit.
+        #   - as a result, after seeing all the functions, we want to go back
+        #     and mark the function decl line as 'not hit' if we decided that
+        #     the function itself is not executed.
+        lineNos = []
+        hits = []
+        ordered = True   # line numbers strictly increasing?
+        for lineNo, hit, branch in lines:
+            if lineNos and lineNo <= lineNos[-1]:
+                ordered = False
+            lineNos.append(lineNo)
+            hits.append(hit)
+
+            if sourceCode and deriveFunctions:
+                # try to derive function names and begin/end lines in Python code
+                if lineNo > len(sourceCode):
+                    self._error('"%s":%d: Error: out of range: file contains %d lines' % (
+                        filename, lineNo, len(sourceCode)))
+                elif scopes is None:
+                    # not valid Python 3 (as far as 'ast' can tell) -
+                    #   fall back to looking at indentation.
+                    m = parseLine.search(sourceCode[lineNo-1])
+                    if m:
+                        indent = count(m.group(1))
+                        #print(sourceCode[lineNo-1])
+                        while currentObj and indent <= currentObj['indent']:
+                            # lower indent - so this is a new object
+                            #print("build " + currentObj['name'])
+                            buildFunction(functions, objStack,
+                                          currentObj, prevLine)
+
+                            try:
+                                currentObj = objStack.pop()
+                            except IndexError as err:
+                                currentObj = None
+                                break
+
+                        if m.group(2):
+                            if currentObj:
+                                objStack.append(currentObj)
+                            objtype = m.group(3)
+                            name = m.group(4).rstrip()
+                            if (-1 != name.find('(') and
+                                ')' != name[-1]):
+                                name += '...)'
+                            currentObj = { 'type':   objtype,
+                                           'name':   name,
+                                           'indent': indent,
+                                           'start':  lineNo,
+                                           'index':  len(lineNos) - 1,
+                            }
+                        else:
+                            # just a line - may be the first executable
+                            #   line in some function:
+                            if currentObj and not 'hit' in currentObj:
+                                currentObj['hit'] = hit
+                                # mark that function decl line is not
+                                #  hit if the function is not hit
+                                if 0 == hit:
+                                    hits[currentObj['index']] = 0
+
+                    prevLine = lineNo
 
+            if isinstance(branch, list):
+                brLines.extend([lineNo] * len(branch))
+                brIds.extend(map(FileCoverage.branch_id, [0] * len(branch),
+                                 range(len(branch))))
+                taken.extend(branch)
+            elif branch:
+                nTaken, total = branch
+                # no information of which clause is taken or not
+                # set taken conditions start from 0 and followed by
+                #  non-taken conditions
+                brLines.extend([lineNo] * total)
+                brIds.extend(map(FileCoverage.branch_id, [0] * total,
+                                 range(total)))
+                nTaken = min(nTaken, total)
+                taken.extend([1] * nTaken)
+                taken.extend([0] * (total - nTaken))
+
+        # and build all the pending functions
+        #  these were still open when we hit the end of file - e.g., because
+        #  they are last elements in some package file and there are no
+        #  no executable lines after the function decl.
+        # There may be more than one function in the stack, if the last
+        # object is nested.
+        while currentObj:
+            buildFunction(functions, objStack, currentObj, prevLine)
+
+            try:
+                currentObj = objStack.pop()
+            except IndexError as err:
+                currentObj = None
+                break
+
+        if not ordered:
+            # duplicate or out-of-order lines:  last entry wins
+            lineData = dict(zip(lineNos, hits))
+            lineNos = sorted(lineData)
+            hits = [lineData[l] for l in lineNos]
+            branchData = dict(zip(zip(brLines, brIds), taken))
+            keys = sorted(branchData)
+            brLines = [k[0] for k in keys]
+            brIds = [k[1] for k in keys]
+            taken = [branchData[k] for k in keys]
+
+        start = time.perf_counter()
+        if scopes:
+            self._derive_functions(scopes, lineNos, hits, functions)
+        deriveTime += time.perf_counter() - start
+
+        start = time.perf_counter()
+        checksums = None
+        if lineChecksums is not None:
+            checksums = []
+            for lineNo in lineNos:
                 try:
-                    currentObj = objStack.pop()
+                    checksums.append(lineChecksums[lineNo-1])
                 except IndexError as err:
-                    currentObj = None
-                    break
+                    print('"%s":%d: unable to compute checksum for missing line' % (filename, lineNo))
+                    if not self._args.keepGoing:
+                        raise(err)
+                    if self._notes is not None:
+                        self._notes['failed'] = True
+                    checksums.append(None)
+        if self._profile:
+            checksumTime += time.perf_counter() - start
+            if deriveFunctions:
+                self._profile.add('derive', filename, deriveTime)
+            if self._args.checksum:
+                self._profile.add('checksum', filename, checksumTime)
 
-            # print the LCOV function data
-            idx = 0
-            for f in functions:
-                totals['function'][0] += 1
-                f['idx'] = idx
-                idx += 1
-                if f['hit']:
-                    totals['function'][1] += 1
-                self._outf.write("FNL:%(idx)d,%(start)d,%(end)d\nFNA:%(idx)d,%(hit)d,%(name)s\n" % f)
-            # print the LCOV line data.
-            for lineNo in sorted(lineData.keys()):
-                checksum = ''
-                if self._args.checksum:
-                    try:
-                        checksum = ',' + line_hash(sourceCode[lineNo-1])
-                    except IndexError as err:
-                        print('"%s":%d: unable to compute checksum for missing line' % (filename, lineNo))
-                        if not self._args.keepGoing:
-                            raise(err)
-
-                self._outf.write("DA:%d,%d%s\n" % (lineNo, lineData[lineNo], checksum));
-
-            # print the LCOV totals - not used by lcov, but maybe somebody does
-            for key in totals:
-                d = totals[key]
-                if d[0] == 0:
-                    continue
-                self._outf.write("%s:%d\n" % (d[2], d[0]))
-                self._outf.write("%s:%d\n" % (d[3], d[1]))
+        return FileCoverage(lineNos, hits, brLines, brIds, taken, functions,
+                            checksums)
+
+    @staticmethod
+    def _derive_functions(scopes, lineNos, hits, functions):
+        # 'scopes' as returned by PythonScopes.find().
+        # A function is executed if the first executable line in its own
+        #  body (i.e., not in some nested function or class) is executed.
+        # Coverage.py marks the 'def' line executed when the containing
+        #  scope is executed - but we want to mark it executed only if the
+        #  function is executed.  So clear the hit count of the decl line
+        #  if the function is not executed.
+        # 'lineNos' is in increasing order; 'hits' is the corresponding
+        #  hit counts.
+        for isFunction, name, line, end, children in scopes:
+            first = bisect.bisect_right(lineNos, line)
+            if first == 0 or lineNos[first - 1] != line:
+                continue  # no code (e.g., excluded region)
+            last = bisect.bisect_right(lineNos, end) - 1
+            hit = None
+            child = 0
+            for idx in range(first, last + 1):
+                lineNo = lineNos[idx]
+                while child < len(children) and children[child][1] < lineNo:
+                    child += 1
+                if child < len(children) and children[child][0] <= lineNo:
+                    continue  # in a nested scope
+                hit = hits[idx]
+                break
+            if hit == 0:
+                hits[first - 1] = 0
+            if isFunction:
+                # function might be unreachable dead code
+                functions.append(FunctionCoverage(name, line, lineNos[last],
+                                                  hit if hit else 0))
+
+
+class _JobOutput:
+    """Text stream which sends everything written to it to the client of
+    a 'serve' job - as JSON lines {"out": text}.  Output is dropped if the
+    client has gone away."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def write(self, text):
+        if text and self._conn is not None:
+            import json
+            try:
+                self._conn.sendall(json.dumps({'out': text}).encode() + b'\n')
+            except OSError:
+                self._conn = None
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _serve_job(conn, parser, run, caches):
+    # run one job:  the client sends one JSON line
+    #   {"argv": [arguments], "cwd": working directory}
+    # and receives the output, then {"exit": status}
+    import contextlib
+    import json
+    import traceback
+    try:
+        request = json.loads(conn.makefile('rb').readline())
+        argv, jobDir = request['argv'], request['cwd']
+    except (OSError, ValueError, TypeError, KeyError):
+        return    # not a client - e.g., a probe for a running server
+    out = _JobOutput(conn)
+    status = 0
+    cwd = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            try:
+                os.chdir(jobDir)
+                caches.refresh()
+                args = parser.parse_args(argv)
+                args.argv = argv
+                run(args, caches)
+            except SystemExit as err:
+                if err.code is None or isinstance(err.code, int):
+                    status = err.code or 0
+                else:
+                    print(err.code)
+                    status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        if status:
+            caches.close()
+    finally:
+        os.chdir(cwd)
+    try:
+        conn.sendall(json.dumps({'exit': status}).encode() + b'\n')
+    except OSError:
+        pass
+
+
+def serve(socketPath, parser, run):
+    """Run the conversion jobs sent to Unix domain socket 'socketPath' -
+    one at a time, until killed.  All jobs share one ConverterCaches, so
+    directory listings, line checksums and version scripts are reused by
+    later jobs.
+    'parser' parses the arguments of each job, and 'run(args, caches)'
+    runs it.  See 'xml2lcov --connect' for the client side."""
+    import signal
+    import socket
+    if os.path.exists(socketPath):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socketPath)
+            print("Error: server is already running on '%s'" % socketPath)
+            sys.exit(1)
+        except OSError:
+            # left behind by a server which was killed
+            os.unlink(socketPath)
+        finally:
+            probe.close()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socketPath)
+    server.listen(16)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    caches = ConverterCaches()
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                _serve_job(conn, parser, run, caches)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        caches.close()
+        server.close()
+        os.unlink(socketPath)
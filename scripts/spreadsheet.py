@@ -656,7 +656,9 @@ class GenerateSpreadsheet(object):
                     row += 1
                 elif k in ('file', 'dir', 'load', 'synth', 'check_version',
                            'annotate', 'parse', 'append', 'segment', 'undump',
-                           'merge', 'gen_info', 'data', 'graph', 'find'):
+                           'merge', 'gen_info', 'data', 'graph', 'find',
+                           'resolve', 'version', 'checksum', 'derive', 'write',
+                           'input'):
                     sheet.write_string(row, 0, k)
                     d = data[k]
                     for n in sorted(d.keys()):
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+
+import sys
+
+def check(arg):
+    if arg == 'a':
+        print('took a')
+    else:
+        print('took b')
+
+check(sys.argv[1])
@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+# Python 2 syntax:  cannot be parsed by the 'ast' module - so functions are
+#   derived from indentation.  See legacy.xml.
+
+def used(a):
+    print "used", a
+    return a
+
+def unused(a):
+    print "unused"
+    return a
+
+used(1)
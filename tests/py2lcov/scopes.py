@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+
+
+def trace(func):
+    @functools.wraps(func)
+    def wrapper(*args):
+        return func(*args)
+    return wrapper
+
+
+@trace
+def decorated(a):
+    return a + 1
+
+
+@trace
+def unusedDecorated(a):
+    return a - 1
+
+
+async def coroutine(x):
+    await asyncio.sleep(0)
+    return x
+
+
+async def unusedCoroutine(x):
+    return x
+
+
+def multiLine(a,
+              b,
+              c=None):
+    return (a, b, c)
+
+
+if __name__ == '__main__':
+    decorated(1)
+    asyncio.run(coroutine(2))
+    multiLine(1, 2)
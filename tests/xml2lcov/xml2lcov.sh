@@ -84,6 +84,7 @@ if [ 'x' == "x$XML2LCOV_TOOL" ] ; then
     PERLLCOV_TOOL=${LCOV_HOME}/bin/perl2lcov
     PY2LCOV_TOOL=${LCOV_HOME}/bin/py2lcov
     XML2LCOV_TOOL=${LCOV_HOME}/bin/xml2lcov
+    TRACEFILE_TOOL=${LCOV_HOME}/bin/tracefileutil.py
 fi
 
 if [ -f $LCOV_HOME/scripts/getp4version ] ; then
@@ -129,7 +130,7 @@ PARENT=`(cd .. ; pwd)`
 
 LCOV_OPTS="--branch-coverage $PARALLEL $PROFILE"
 
-rm -rf *.info *.json __pycache__ help.txt *.pyc *.dat
+rm -rf ./--source *.info *.info.gz *.xml.gz *.json *.log xmlCache xml2lcovbench startupbench shard xml2lcov.sock __pycache__ help.txt *.pyc *.dat
 
 if [ "x$COVER" != 'x' ] && [ 0 != $LOCAL_COVERAGE ] ; then
     cover -delete
@@ -164,6 +165,283 @@ if [ 0 != $? ] ; then
     fi
 fi
 
+# parallel translation should give the same result as serial
+eval ${PYCOV} ${XML2LCOV_TOOL} -o serial.info coverage.xml coverage.xml
+if [ 0 != $? ] ; then
+    echo "xml2lcov serial failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+eval ${PYCOV} ${XML2LCOV_TOOL} --parallel 2 -o parallel.info coverage.xml coverage.xml
+if [ 0 != $? ] ; then
+    echo "xml2lcov --parallel failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+diff serial.info parallel.info
+if [ 0 != $? ] ; then
+    echo "serial vs parallel failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+
+# compressed input and output
+gzip -c coverage.xml > coverage.xml.gz
+eval ${PYCOV} ${XML2LCOV_TOOL} -o compressed.info.gz coverage.xml.gz coverage.xml
+if [ 0 != $? ] ; then
+    echo "xml2lcov compressed input failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+gunzip -c compressed.info.gz | diff serial.info -
+if [ 0 != $? ] ; then
+    echo "compressed vs uncompressed failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+
+# cached translation should match - both when the cache is populated and
+#  when it is reused
+for pass in 1 2 ; do
+    eval ${PYCOV} ${XML2LCOV_TOOL} -o cached$pass.info --cache-dir xmlCache coverage.xml coverage.xml > cached$pass.log
+    if [ 0 != $? ] ; then
+        echo "xml2lcov --cache-dir failed"
+        if [ 0 == $KEEP_GOING ] ; then
+            exit 1
+        fi
+    fi
+    diff serial.info cached$pass.info
+    if [ 0 != $? ] ; then
+        echo "cached translation pass $pass differs"
+        if [ 0 == $KEEP_GOING ] ; then
+            exit 1
+        fi
+    fi
+done
+# ... and the warnings are repeated when the cache is used
+diff cached1.log cached2.log
+if [ 0 != $? ] ; then
+    echo "cached translation warnings differ"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+# a source file which appears in the search path invalidates the entry
+mkdir -p ./--source/org/apache/commons/math3/stat/descriptive/rank
+touch ./--source/org/apache/commons/math3/stat/descriptive/rank/Max_.java
+eval ${PYCOV} ${XML2LCOV_TOOL} -o cached3.info --cache-dir xmlCache coverage.xml
+eval ${PYCOV} ${XML2LCOV_TOOL} -o uncached3.info coverage.xml
+grep -q 'SF:--source/org/apache/commons/math3/stat/descriptive/rank/Max_.java' uncached3.info && diff uncached3.info cached3.info
+if [ 0 != $? ] ; then
+    echo "cached translation did not see new source file"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+rm -rf ./--source
+
+# profile data should be valid JSON, with config and total time
+eval ${PYCOV} ${XML2LCOV_TOOL} -o profile.info coverage.xml --profile
+if [ 0 != $? ] ; then
+    echo "xml2lcov --profile failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+python3 -c "import json,sys; d=json.load(open('profile.info.json')); sys.exit(0 if 'config' in d and 'total' in d and 'file' in d else 1)"
+if [ 0 != $? ] ; then
+    echo "unexpected profile data"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+
+# split a large XML file at package boundaries:  result should be the same
+${PARENT}/bin/mkxml ${PARENT}/profiles/medium -o shard --seed 1 files.numfiles=100
+if [ 0 != $? ] ; then
+    echo "mkxml failed"
+    exit 1
+fi
+eval ${PYCOV} ${XML2LCOV_TOOL} -o shardSerial.info shard/coverage.xml
+eval ${PYCOV} ${XML2LCOV_TOOL} -o shard.info --parallel 2 --shard --verbose shard/coverage.xml shard/coverage.xml > shard.log
+if [ 0 != $? ] ; then
+    echo "xml2lcov --shard failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+grep -E 'coverage.xml in [0-9]+ shards' shard.log
+if [ 0 != $? ] ; then
+    echo "xml2lcov --shard did not split input"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+cat shardSerial.info <(grep -v -E '^TN:' shardSerial.info) | diff - shard.info
+if [ 0 != $? ] ; then
+    echo "sharded result differs"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+
+# merge mode:  expect one record per source file, no matter how many inputs
+eval ${PYCOV} ${XML2LCOV_TOOL} --merge -o merge1.info coverage.xml
+if [ 0 != $? ] ; then
+    echo "xml2lcov --merge failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+eval ${PYCOV} ${XML2LCOV_TOOL} --merge -o merge2.info coverage.xml coverage.xml
+if [ 0 != $? ] ; then
+    echo "xml2lcov --merge failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+ONE=`grep -c SF: merge1.info`
+TWO=`grep -c SF: merge2.info`
+if [ $ONE != $TWO ] ; then
+    echo "merge: expected $ONE records, found $TWO"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+
+# classes in the same source file are combined:  one record per file
+eval ${PYCOV} ${XML2LCOV_TOOL} -o single.info coverage.xml
+DUPS=`grep SF: single.info | sort | uniq -d | wc -l`
+if [ 0 != $DUPS ] ; then
+    echo "found $DUPS source files with more than one record"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+diff merge1.info single.info
+if [ 0 != $? ] ; then
+    echo "combined classes differ from merged data"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+
+# merging the tracefiles in Python should give the same result as merging
+#   the inputs - and reading then writing the result should not change it
+eval ${PYCOV} ${TRACEFILE_TOOL} -o merge3.info serial.info
+if [ 0 != $? ] ; then
+    echo "tracefileutil merge failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+diff merge2.info merge3.info
+if [ 0 != $? ] ; then
+    echo "tracefileutil merge differs from xml2lcov --merge"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+eval ${PYCOV} ${TRACEFILE_TOOL} -o roundTrip.info.gz merge3.info
+gunzip -c roundTrip.info.gz | diff merge3.info -
+if [ 0 != $? ] ; then
+    echo "tracefileutil round trip failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+# missing input is an error - but ignored with '-k'
+eval ${PYCOV} ${TRACEFILE_TOOL} -o missing.info merge3.info noSuchFile.info > missing.log 2>&1
+if [ 0 == $? ] || ! grep -q "noSuchFile.info.*Error: unable to read" missing.log ; then
+    echo "tracefileutil did not report missing input"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+eval ${PYCOV} ${TRACEFILE_TOOL} -k -o missing.info merge3.info noSuchFile.info > missing.log 2>&1
+if [ 0 != $? ] ; then
+    echo "tracefileutil -k failed with missing input"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+diff merge3.info missing.info
+if [ 0 != $? ] ; then
+    echo "tracefileutil -k result differs with missing input"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+# data outside of an SF record is a format error
+printf 'TN:\nDA:1,1\nSF:a.c\nDA:1,1\nend_of_record\n' > noSF.info
+eval ${PYCOV} ${TRACEFILE_TOOL} -o noSF2.info noSF.info > noSF.log 2>&1
+if [ 0 == $? ] || ! grep -q "noSF.info\":2: Error: 'DA' record outside of SF" noSF.log ; then
+    echo "tracefileutil did not report data outside of SF"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+
+# a plain translation should not load modules used only by optional
+#   features - startup is most of the cost of a small job
+python3 -X importtime ${XML2LCOV_TOOL} -o imports.info coverage.xml 2> imports.log
+if [ 0 != $? ] ; then
+    echo "xml2lcov -X importtime failed"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+grep -E '\| +(pdb|subprocess|concurrent\.futures|socket|hashlib|tempfile)$' imports.log
+if [ 0 == $? ] ; then
+    echo "unexpected module imported at startup"
+    if [ 0 == $KEEP_GOING ] ; then
+        exit 1
+    fi
+fi
+
+# jobs run by the server should give the same result as running them here
+eval "${PYCOV} ${XML2LCOV_TOOL} --serve xml2lcov.sock &"
+SERVER=$!
+for i in `seq 20` ; do
+    if [ -S xml2lcov.sock ] ; then
+        break
+    fi
+    sleep 0.5
+done
+for pass in 1 2 ; do
+    eval ${PYCOV} ${XML2LCOV_TOOL} --connect xml2lcov.sock -o served$pass.info coverage.xml coverage.xml
+    if [ 0 != $? ] ; then
+        echo "xml2lcov --connect failed"
+        if [ 0 == $KEEP_GOING ] ; then
+            kill $SERVER
+            exit 1
+        fi
+    fi
+    diff serial.info served$pass.info
+    if [ 0 != $? ] ; then
+        echo "served result differs (pass $pass)"
+        if [ 0 == $KEEP_GOING ] ; then
+            kill $SERVER
+            exit 1
+        fi
+    fi
+done
+eval ${PYCOV} ${XML2LCOV_TOOL} --connect xml2lcov.sock -o servedErr.info y.xml
+if [ 0 == $? ] ; then
+    echo "did not see error from server with missing input file"
+    if [ 0 == $KEEP_GOING ] ; then
+        kill $SERVER
+        exit 1
+    fi
+fi
+kill $SERVER
+wait $SERVER
+
 # version check should fail - because we have no source
 eval ${PYCOV} ${XML2LCOV_TOOL} -o noSource.info coverage.xml $VERSION
 if [ 0 == $? ] ; then